@@ -0,0 +1,120 @@
+import asyncio
+import heapq
+import itertools
+import time
+from contextlib import asynccontextmanager
+
+# ============================================================
+# Admission control des webhooks (limite + file d'attente bornée)
+# ============================================================
+
+# plus petit = plus prioritaire
+PRIORITY_PAYMENT = 0   # notification PayPlug "payé" : l'argent est déjà encaissé
+PRIORITY_LINK = 1      # création d'un lien de paiement
+
+
+class AdmissionRejected(Exception):
+    """Requête refusée sans être traitée : status_code 429 (file pleine) ou 503 (attente trop longue)."""
+
+    def __init__(self, reason: str, status_code: int, retry_after: float):
+        self.reason = reason
+        self.status_code = status_code
+        self.retry_after = max(1.0, retry_after)
+        super().__init__(f"Service saturé ({reason}), réessayer dans {self.retry_after:.0f}s")
+
+
+class AdmissionController:
+    """
+    Au plus `limit` traitements simultanés ; au-delà, attente dans une file bornée
+    servie par priorité puis par ordre d'arrivée. File pleine : une requête
+    prioritaire évince la moins prioritaire en attente, sinon refus immédiat.
+    """
+
+    def __init__(self, limit: int, queue_size: int, queue_timeout: float):
+        self.limit = limit
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self._waiters: list[tuple[int, int, asyncio.Future]] = []  # heap (priorité, seq, future)
+        self._seq = itertools.count()
+        self._service_time = 1.0  # moyenne glissante (s) d'un traitement
+        self.admitted = 0
+        self.rejected = {"queue_full": 0, "timeout": 0, "shed": 0}
+
+    def _retry_after(self) -> float:
+        return self._service_time * (len(self._waiters) + 1) / max(1, self.limit)
+
+    def _live_waiters(self) -> list[tuple[int, int, asyncio.Future]]:
+        return [w for w in self._waiters if not w[2].done()]
+
+    def _shed_lowest(self, priority: int) -> bool:
+        """Évince le dernier arrivé parmi les moins prioritaires, s'il l'est moins que `priority`."""
+        live = self._live_waiters()
+        if not live:
+            return False
+        victim = max(live, key=lambda w: (w[0], w[1]))
+        if victim[0] <= priority:
+            return False
+        self._waiters.remove(victim)
+        heapq.heapify(self._waiters)
+        victim[2].set_exception(AdmissionRejected("shed", 503, self._retry_after()))
+        self.rejected["shed"] += 1
+        return True
+
+    async def _acquire(self, priority: int, timeout: float) -> None:
+        if self.in_flight < self.limit and not self._live_waiters():
+            self.in_flight += 1
+            return
+        if len(self._live_waiters()) >= self.queue_size and not self._shed_lowest(priority):
+            self.rejected["queue_full"] += 1
+            raise AdmissionRejected("queue_full", 429, self._retry_after())
+        fut = asyncio.get_running_loop().create_future()
+        entry = (priority, next(self._seq), fut)
+        heapq.heappush(self._waiters, entry)
+        try:
+            await asyncio.wait_for(asyncio.shield(fut), timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            granted = fut.done() and not fut.cancelled() and fut.exception() is None
+            if granted and isinstance(e, asyncio.TimeoutError):
+                return  # slot accordé au dernier moment : on le garde
+            if granted:
+                self._release(0.0)  # client parti : le slot passe au suivant
+            else:
+                fut.cancel()
+                if entry in self._waiters:
+                    self._waiters.remove(entry)
+                    heapq.heapify(self._waiters)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            self.rejected["timeout"] += 1
+            raise AdmissionRejected("timeout", 503, self._retry_after())
+
+    def _release(self, elapsed: float) -> None:
+        self._service_time = 0.8 * self._service_time + 0.2 * elapsed
+        while self._waiters:
+            _, _, fut = heapq.heappop(self._waiters)
+            if not fut.done():
+                fut.set_result(None)  # le slot passe directement au suivant
+                return
+        self.in_flight -= 1
+
+    @asynccontextmanager
+    async def slot(self, priority: int = PRIORITY_LINK, timeout: float | None = None):
+        wait = self.queue_timeout if timeout is None else max(0.0, min(self.queue_timeout, timeout))
+        await self._acquire(priority, wait)
+        self.admitted += 1
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(time.monotonic() - start)
+
+    def stats(self) -> dict:
+        return {
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "queued": len(self._live_waiters()),
+            "queue_size": self.queue_size,
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected),
+        }
@@ -0,0 +1,87 @@
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from .config import settings
+from .evoliz import open_quote_pdf
+from .monday import add_file_to_column, get_file_names
+
+logger = logging.getLogger("energyz.attachments")
+
+# ============================================================
+# PDF du devis Evoliz -> colonne fichier Monday
+# ============================================================
+
+# nombre d'uploads simultanés borné par la taille du pool
+_UPLOAD_POOL = ThreadPoolExecutor(max_workers=settings.PDF_UPLOAD_CONCURRENCY, thread_name_prefix="pdf-upload")
+_PENDING: dict[tuple[int, str, str], Future] = {}
+_PENDING_LOCK = threading.Lock()
+STATS = {"uploaded": 0, "skipped": 0, "failed": 0}
+
+
+def _tagged_filename(filename: str, digest: str) -> str:
+    """'devis_12.pdf' -> 'devis_12-<hash>.pdf' : le contenu se reconnaît au nom dans Monday."""
+    stem, ext = os.path.splitext(filename)
+    return f"{stem}-{digest[:12]}{ext or '.pdf'}"
+
+
+def attach_quote_pdf(item_id: int, quote_id: str, column_id: str) -> dict:
+    """
+    Copie le PDF du devis dans la colonne fichier de l'item, par morceaux :
+    Evoliz -> fichier temporaire (hash calculé au passage) -> upload multipart Monday.
+    Un fichier de même contenu déjà présent dans la colonne n'est pas renvoyé.
+    """
+    r, filename = open_quote_pdf(quote_id)
+    sha = hashlib.sha256()
+    size = 0
+    with tempfile.TemporaryFile() as spool:
+        try:
+            for chunk in r.iter_content(chunk_size=settings.PDF_CHUNK_SIZE):
+                sha.update(chunk)
+                spool.write(chunk)
+                size += len(chunk)
+        finally:
+            r.close()
+        digest = sha.hexdigest()
+        name = _tagged_filename(filename, digest)
+        if any(digest[:12] in existing for existing in get_file_names(item_id, column_id)):
+            return {"status": "skipped", "item_id": item_id, "quote_id": quote_id, "file": name}
+        spool.seek(0)
+        asset_id = add_file_to_column(item_id, column_id, name, spool, size)
+    return {"status": "uploaded", "item_id": item_id, "quote_id": quote_id, "file": name,
+            "bytes": size, "asset_id": asset_id}
+
+
+def _done(key: tuple[int, str, str], fut: Future) -> None:
+    with _PENDING_LOCK:
+        _PENDING.pop(key, None)
+    exc = fut.exception()
+    if exc is not None:
+        STATS["failed"] += 1
+        logger.error(f"[PDF] item_id={key[0]} devis={key[2]} KO: {exc}")
+        return
+    result = fut.result()
+    STATS[result["status"]] += 1
+    logger.info(f"[PDF] item_id={key[0]} devis={key[2]} {result['status']} file={result['file']}")
+
+
+def schedule_quote_pdf(item_id: int, quote_id: str, column_id: str) -> Future:
+    """Planifie l'upload ; une demande identique déjà en cours est réutilisée."""
+    key = (int(item_id), column_id, str(quote_id))
+    with _PENDING_LOCK:
+        fut = _PENDING.get(key)
+        if fut is not None:
+            return fut
+        fut = _UPLOAD_POOL.submit(attach_quote_pdf, key[0], key[2], column_id)
+        _PENDING[key] = fut
+    fut.add_done_callback(lambda f: _done(key, f))
+    return fut
+
+
+def stats() -> dict:
+    with _PENDING_LOCK:
+        pending = len(_PENDING)
+    return {"concurrency": settings.PDF_UPLOAD_CONCURRENCY, "pending": pending, **STATS}
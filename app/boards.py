@@ -0,0 +1,88 @@
+import asyncio
+import contextvars
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+from .admission import AdmissionController
+from .config import _json_setting, build_routing_tables, settings
+from .profiler import run_tracked
+
+# ============================================================
+# Boards servis par le déploiement (config, routage, pool de workers)
+# ============================================================
+
+
+class BoardConfig:
+    """
+    Config d'un board : les clés de sa section BOARDS_JSON, sinon les valeurs
+    globales de Settings (board.EMAIL_COLUMN_ID, board.FORMULA_COLUMN_IDS_JSON, ...).
+    Chaque board a son propre pool de threads et sa propre admission (limite alignée
+    sur le pool, file bornée) : un board saturé n'affame pas les autres.
+    """
+
+    def __init__(self, board_id: int, overrides: dict | None = None):
+        self._overrides = {
+            k: (json.dumps(v) if k.endswith("_JSON") and isinstance(v, dict) else v)
+            for k, v in (overrides or {}).items()
+        }
+        self.board_id = int(board_id)
+        self.max_concurrency = int(self._overrides.get("MAX_CONCURRENCY") or settings.BOARD_MAX_CONCURRENCY)
+        self.routes = build_routing_tables(self)
+        self._pool = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix=f"board-{self.board_id}")
+        self.admission = AdmissionController(
+            self.max_concurrency,
+            int(self._overrides.get("ADMISSION_QUEUE_SIZE") or settings.ADMISSION_QUEUE_SIZE),
+            settings.ADMISSION_QUEUE_TIMEOUT_SECONDS,
+        )
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.queued = 0
+
+    def __getattr__(self, name: str):
+        overrides = self.__dict__.get("_overrides", {})
+        if name in overrides:
+            return overrides[name]
+        return getattr(settings, name)
+
+    async def run(self, fn, *args):
+        """Exécute fn(*args) (bloquant) dans le pool du board, contexte (trace) compris."""
+        ctx = contextvars.copy_context()
+        with self._lock:
+            self.queued += 1
+
+        def call():
+            with self._lock:
+                self.queued -= 1
+                self.in_flight += 1
+            try:
+                return ctx.run(run_tracked, fn, *args)
+            finally:
+                with self._lock:
+                    self.in_flight -= 1
+
+        return await asyncio.get_running_loop().run_in_executor(self._pool, call)
+
+    def stats(self) -> dict:
+        return {"max_concurrency": self.max_concurrency, "in_flight": self.in_flight, "queued": self.queued,
+                "admission": self.admission.stats()}
+
+
+@lru_cache(maxsize=1)
+def board_configs() -> dict[int, BoardConfig]:
+    sections = _json_setting(settings.BOARDS_JSON, {})
+    boards = {int(bid): BoardConfig(int(bid), section) for bid, section in sections.items()}
+    if int(settings.MONDAY_BOARD_ID) not in boards:
+        boards[int(settings.MONDAY_BOARD_ID)] = BoardConfig(int(settings.MONDAY_BOARD_ID))
+    return boards
+
+
+def get_board(board_id=None) -> BoardConfig | None:
+    """Board ciblé par un événement ; sans board_id, le board par défaut (MONDAY_BOARD_ID)."""
+    if board_id in (None, ""):
+        board_id = settings.MONDAY_BOARD_ID
+    try:
+        return board_configs().get(int(board_id))
+    except (TypeError, ValueError):
+        return None
@@ -1,3 +1,6 @@
+import json
+from functools import lru_cache
+
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
@@ -10,6 +13,8 @@ class Settings(BaseSettings):
     EVOLIZ_COMPANY_ID: str
     EVOLIZ_PUBLIC_KEY: str
     EVOLIZ_SECRET_KEY: str
+    EVOLIZ_APP_BASE_URL: str | None = None   # hôte alternatif (PDF, lien app)
+    EVOLIZ_TENANT_SLUG: str | None = None    # lien app https://evoliz.com/<slug>/...
 
     # PayPlug
     PAYPLUG_KEYS_TEST_JSON: str
@@ -37,4 +42,117 @@ class Settings(BaseSettings):
     # IBAN mapping fallback
     IBAN_BY_STATUS_JSON: str | None = None
 
+    # Résilience upstream (circuit breakers / hedging)
+    UPSTREAM_TIMEOUT_SECONDS: float = 30.0
+    BREAKER_WINDOW: int = 20
+    BREAKER_MIN_CALLS: int = 5
+    BREAKER_FAILURE_RATIO: float = 0.5
+    BREAKER_SLOW_CALL_SECONDS: float = 10.0
+    BREAKER_SLOW_RATIO: float = 0.8
+    BREAKER_OPEN_SECONDS: float = 30.0
+    HEDGE_AFTER_MS: int | None = None
+
+    # Deadline des webhooks (Monday abandonne l'appel au-delà) + timeouts adaptatifs
+    REQUEST_BUDGET_SECONDS: float = 25.0
+    LATENCY_WINDOW: int = 200
+    ADAPTIVE_TIMEOUT_MIN_SAMPLES: int = 20
+    ADAPTIVE_TIMEOUT_PERCENTILE: float = 0.99
+    ADAPTIVE_TIMEOUT_FACTOR: float = 3.0
+    ADAPTIVE_TIMEOUT_MIN_SECONDS: float = 2.0
+
+    # Cache schéma / formules
+    SCHEMA_TTL_SECONDS: float = 300.0
+    FORMULA_CACHE_MAX_ITEMS: int = 5000
+    FORMULA_CACHE_TTL_SECONDS: float = 120.0
+
+    # Miroir local du board (SQLite)
+    MIRROR_ENABLED: bool = False
+    MIRROR_DB_PATH: str = "board_mirror.sqlite3"
+    MIRROR_MAX_AGE_SECONDS: float = 900.0
+    MIRROR_PAGE_SIZE: int = 500
+
+    # Annuaire local Evoliz (clients / prospects)
+    EVOLIZ_DIRECTORY_TTL_SECONDS: float = 600.0
+    EVOLIZ_DIRECTORY_PAGE_SIZE: int = 100
+
+    # Export streamé
+    EXPORT_PAGE_SIZE: int = 200
+
+    # PDF du devis Evoliz -> colonne fichier Monday (désactivé si colonnes vides)
+    QUOTE_ID_COLUMN_ID: str | None = None
+    QUOTE_PDF_COLUMN_ID: str | None = None
+    PDF_UPLOAD_CONCURRENCY: int = 3
+    PDF_CHUNK_SIZE: int = 64 * 1024
+
+    # Warm-up au démarrage
+    WARMUP_BUDGET_SECONDS: float = 20.0
+
+    # Admission control des webhooks, par board (limite = BOARD_MAX_CONCURRENCY du board)
+    # ADMISSION_QUEUE_SIZE se surcharge par board dans BOARDS_JSON
+    ADMISSION_QUEUE_SIZE: int = 16
+    ADMISSION_QUEUE_TIMEOUT_SECONDS: float = 10.0
+
+    # Debounce des changements de statut (par item)
+    DEBOUNCE_WINDOW_MS: int = 1500
+
+    # Enregistrement du trafic webhook pour rejeu (désactivé si vide)
+    RECORD_PATH: str | None = None
+
+    # Traces en mémoire (ring buffer)
+    TRACE_BUFFER_SIZE: int = 200
+
+    # Plans de paiement pré-résolus avant le label "Acompte N" (opt-in)
+    # PREFETCH_STATUS_LABELS_JSON : {"1": "Devis signé", "2": "Travaux terminés"} (statut qui précède l'acompte)
+    SPECULATIVE_PLANS: bool = False
+    PREFETCH_STATUS_LABELS_JSON: str | None = None
+    PLAN_TTL_SECONDS: float = 120.0
+    PREFETCH_CONCURRENCY: int = 2
+
+    # Profiler par échantillonnage (admin / header X-Profile)
+    PROFILE_INTERVAL_MS: int = 10
+    PROFILE_MAX_SECONDS: float = 120.0
+    PROFILE_BUFFER_SIZE: int = 20
+
+    # Multi-boards : {"<board_id>": {"EMAIL_COLUMN_ID": ..., "FORMULA_COLUMN_IDS_JSON": {...}, ...}}
+    # (les clés absentes reprennent les valeurs globales ci-dessus)
+    BOARDS_JSON: str | None = None
+    BOARD_MAX_CONCURRENCY: int = 4
+
+    # Endpoints d'administration (désactivés sans token)
+    ADMIN_TOKEN: str | None = None
+
 settings = Settings()
+
+
+def _json_setting(raw, default):
+    if isinstance(raw, dict):
+        return raw
+    if not raw:
+        return default
+    try:
+        parsed = json.loads(raw)
+    except Exception:
+        return default
+    return parsed if isinstance(parsed, dict) else default
+
+
+def build_routing_tables(cfg) -> dict:
+    """Mappings JSON (acomptes, statuts, IBAN, clés PayPlug) d'une config : settings ou un board."""
+    mode = (cfg.PAYPLUG_MODE or "").lower()
+    return {
+        "formula_cols": _json_setting(cfg.FORMULA_COLUMN_IDS_JSON, {}),
+        "link_columns": _json_setting(cfg.LINK_COLUMN_IDS_JSON, {}),
+        "status_after": _json_setting(cfg.STATUS_AFTER_PAY_JSON, {}),
+        "trigger_labels": _json_setting(cfg.TRIGGER_LABELS_JSON, {}) or {"1": "Acompte 1", "2": "Acompte 2"},
+        "iban_by_status": _json_setting(cfg.IBAN_BY_STATUS_JSON, {}),
+        "prefetch_labels": _json_setting(cfg.PREFETCH_STATUS_LABELS_JSON, {}),
+        "payplug_keys": _json_setting(
+            cfg.PAYPLUG_KEYS_TEST_JSON if mode == "test" else cfg.PAYPLUG_KEYS_LIVE_JSON, {}
+        ),
+    }
+
+
+@lru_cache(maxsize=1)
+def routing_tables() -> dict:
+    """Mappings JSON de l'env global, parsés une seule fois."""
+    return build_routing_tables(settings)
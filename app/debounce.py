@@ -0,0 +1,44 @@
+import asyncio
+import itertools
+
+# ============================================================
+# Debounce des événements status Monday, par item
+# ============================================================
+
+
+class Debouncer:
+    """
+    Regroupe les rafales d'événements d'une même clé : chaque événement attend
+    `window_seconds` ; seul le dernier arrivé pendant la fenêtre est traité,
+    les précédents sont abandonnés (et comptés).
+    """
+
+    def __init__(self, window_seconds: float):
+        self.window_seconds = window_seconds
+        self._latest: dict[str, int] = {}
+        self._seq = itertools.count(1)
+        self.passed = 0
+        self.dropped = 0
+
+    async def settle(self, key: str) -> bool:
+        """True si cet événement est le dernier de sa rafale et doit être traité."""
+        if self.window_seconds <= 0:
+            self.passed += 1
+            return True
+        seq = next(self._seq)
+        self._latest[key] = seq
+        await asyncio.sleep(self.window_seconds)
+        if self._latest.get(key) != seq:
+            self.dropped += 1
+            return False
+        del self._latest[key]
+        self.passed += 1
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "window_ms": round(self.window_seconds * 1000),
+            "pending": len(self._latest),
+            "passed": self.passed,
+            "dropped": self.dropped,
+        }
@@ -1,9 +1,15 @@
 import datetime as dt
+import logging
 import re
+import threading
+import time
 from typing import Optional, Tuple, Dict, Any
 
 import requests
 from .config import settings
+from .resilience import DeadlineExceeded, check_deadline, guarded_request, hedged
+
+logger = logging.getLogger("energyz.evoliz")
 
 # ============================================================
 # Auth Evoliz (Bearer)
@@ -14,7 +20,9 @@ SESSION: dict[str, Optional[str]] = {"token": None}
 
 def _login() -> str:
     url = f"{settings.EVOLIZ_BASE_URL}/api/login"
-    r = requests.post(
+    r = guarded_request(
+        "evoliz",
+        "POST",
         url,
         json={"public_key": settings.EVOLIZ_PUBLIC_KEY, "secret_key": settings.EVOLIZ_SECRET_KEY},
         headers={"Content-Type": "application/json"},
@@ -35,12 +43,12 @@ def _headers() -> dict:
     return {"Authorization": f"Bearer {SESSION['token']}", "Content-Type": "application/json"}
 
 
-def _request(method: str, base: str, path: str, payload: dict | None = None):
+def _request(method: str, base: str, path: str, payload: dict | None = None, params: dict | None = None):
     url = f"{base}{path}"
-    r = requests.request(method, url, headers=_headers(), json=payload or {}, timeout=25)
+    r = guarded_request("evoliz", method, url, headers=_headers(), json=payload or {}, params=params, timeout=25)
     if r.status_code == 401:
         _login()
-        r = requests.request(method, url, headers=_headers(), json=payload or {}, timeout=25)
+        r = guarded_request("evoliz", method, url, headers=_headers(), json=payload or {}, params=params, timeout=25)
     if not r.ok:
         raise Exception(f"Evoliz API error {r.status_code}: {r.text}")
     return r.json()
@@ -50,26 +58,34 @@ def _post(path: str, payload: dict | None = None):
     return _request("POST", settings.EVOLIZ_BASE_URL, path, payload)
 
 
-def _get_bytes(base: str, path: str) -> tuple[bytes, str | None]:
+def _open_binary(base: str, path: str) -> requests.Response:
     """
-    GET binaire (PDF) avec hôte paramétrable (www.evoliz.io OU app.evoliz.com).
+    GET binaire (PDF) en streaming avec hôte paramétrable (www.evoliz.io OU app.evoliz.com).
+    Le corps n'est pas lu : à consommer via iter_content() puis close().
     """
     url = f"{base}{path}"
     h = _headers()
     h.pop("Content-Type", None)  # IMPORTANT pour binaire
-    r = requests.get(url, headers=h, timeout=60)
+    r = guarded_request("evoliz", "GET", url, headers=h, timeout=60, stream=True)
     if r.status_code == 401:
+        r.close()
         _login()
         h = _headers()
         h.pop("Content-Type", None)
-        r = requests.get(url, headers=h, timeout=60)
-    r.raise_for_status()
-    return r.content, r.headers.get("content-disposition")
+        r = guarded_request("evoliz", "GET", url, headers=h, timeout=60, stream=True)
+    try:
+        r.raise_for_status()
+    except requests.HTTPError:
+        r.close()
+        raise
+    return r
 
 
 def _post_ignore_errors(path: str, payload: dict | None = None) -> Optional[dict]:
     try:
         return _post(path, payload or {})
+    except DeadlineExceeded:
+        raise
     except Exception:
         return None
 
@@ -106,6 +122,135 @@ def _find_prospect_by_name(name: str) -> Optional[str]:
     return None
 
 
+# ============================================================
+# Annuaire local Clients / Prospects
+# ============================================================
+#
+# Index mémoire (email normalisé / nom normalisé -> id), construit par une
+# synchro complète paginée puis rafraîchi par des synchros incrémentales
+# (pages triées par date de modification décroissante, arrêt au dernier repère).
+
+_UPDATED_KEYS = ("lastupdate", "updated_at", "modified_at", "last_update")
+
+
+def _norm_email(email: str | None) -> str:
+    return (email or "").strip().lower()
+
+
+def _norm_name(name: str | None) -> str:
+    return " ".join((name or "").split()).lower()
+
+
+def _updated_at(it: dict) -> str:
+    for k in _UPDATED_KEYS:
+        if it.get(k):
+            return str(it[k])
+    return ""
+
+
+DIRECTORY: dict[str, Any] = {
+    "clients_by_email": {},
+    "prospects_by_email": {},
+    "prospects_by_name": {},
+    "watermark": {"clients": "", "prospects": ""},
+    "synced_at": 0.0,
+    "full_synced": False,
+}
+_DIRECTORY_LOCK = threading.Lock()
+_DIRECTORY_SYNC_LOCK = threading.Lock()
+
+
+def _directory_add(endpoint: str, it: dict) -> None:
+    rid = it.get("id") or it.get(f"{endpoint[:-1]}id")
+    if not rid:
+        return
+    rid = str(rid)
+    email = _norm_email(it.get("email"))
+    if endpoint == "clients":
+        if email:
+            DIRECTORY["clients_by_email"][email] = rid
+        return
+    if email:
+        DIRECTORY["prospects_by_email"][email] = rid
+    name = _norm_name(it.get("name"))
+    if name:
+        DIRECTORY["prospects_by_name"][name] = rid
+
+
+def _iter_pages(endpoint: str, params: dict | None = None):
+    page = 1
+    while True:
+        data = _request(
+            "GET",
+            settings.EVOLIZ_BASE_URL,
+            f"/api/v1/companies/{settings.EVOLIZ_COMPANY_ID}/{endpoint}",
+            params={"page": page, "per_page": settings.EVOLIZ_DIRECTORY_PAGE_SIZE, **(params or {})},
+        )
+        items = data if isinstance(data, list) else data.get("data") or []
+        yield items
+        meta = (data.get("meta") or {}) if isinstance(data, dict) else {}
+        last_page = meta.get("last_page")
+        if not items or (last_page and page >= int(last_page)) or (not last_page and len(items) < settings.EVOLIZ_DIRECTORY_PAGE_SIZE):
+            return
+        page += 1
+
+
+def sync_directory(full: bool = False) -> dict:
+    """Synchro complète (full=True ou premier appel) ou incrémentale de l'annuaire."""
+    full = full or not DIRECTORY["full_synced"]
+    counts = {}
+    for endpoint in ("clients", "prospects"):
+        watermark = "" if full else DIRECTORY["watermark"][endpoint]
+        newest = watermark
+        n = 0
+        params = None if full else {"sort_by": "lastupdate", "sort_order": "desc"}
+        for items in _iter_pages(endpoint, params):
+            fresh = 0
+            with _DIRECTORY_LOCK:
+                for it in items:
+                    updated = _updated_at(it)
+                    if watermark and updated and updated <= watermark:
+                        continue
+                    _directory_add(endpoint, it)
+                    fresh += 1
+                    if updated > newest:
+                        newest = updated
+            n += fresh
+            # pages triées du plus récent au plus ancien : une page sans nouveauté clôt la synchro
+            # (seulement si le tri a bien été appliqué côté serveur, sinon on parcourt tout)
+            stamps = [_updated_at(it) for it in items]
+            if watermark and not fresh and stamps == sorted(stamps, reverse=True):
+                break
+        DIRECTORY["watermark"][endpoint] = newest
+        counts[endpoint] = n
+    DIRECTORY["synced_at"] = time.monotonic()
+    DIRECTORY["full_synced"] = True
+    logger.info(f"[EVOLIZ-DIR] sync {'full' if full else 'incr'} {counts}")
+    return counts
+
+
+def _directory_ready() -> bool:
+    """Annuaire utilisable ; relance une synchro incrémentale s'il est trop ancien."""
+    if DIRECTORY["full_synced"] and time.monotonic() - DIRECTORY["synced_at"] < settings.EVOLIZ_DIRECTORY_TTL_SECONDS:
+        return True
+    # une seule synchro à la fois ; les autres appels se servent de l'état courant
+    if _DIRECTORY_SYNC_LOCK.acquire(blocking=not DIRECTORY["full_synced"]):
+        try:
+            sync_directory()
+        except Exception as e:
+            logger.warning(f"[EVOLIZ-DIR] sync KO, recherche distante: {e}")
+        finally:
+            _DIRECTORY_SYNC_LOCK.release()
+    return DIRECTORY["full_synced"]
+
+
+def _lookup(index: str, key: str) -> Optional[str]:
+    if not key:
+        return None
+    with _DIRECTORY_LOCK:
+        return DIRECTORY[index].get(key)
+
+
 def _normalize_address(addr: Dict[str, Any] | None) -> Dict[str, str]:
     addr = addr or {}
     street_obj = addr.get("street") or {}
@@ -124,24 +269,43 @@ def _create_prospect(name: str, email: str, address_json: Dict[str, Any] | None)
     payload = {"name": name or (email.split("@")[0] if email else "Prospect"), "email": email or "", "address": address}
     try:
         data = _post(f"/api/v1/companies/{settings.EVOLIZ_COMPANY_ID}/prospects", payload)
-        return str(data.get("id") or data.get("prospectid") or (data.get("data") or {}).get("id"))
+        pid = str(data.get("id") or data.get("prospectid") or (data.get("data") or {}).get("id"))
+        with _DIRECTORY_LOCK:
+            _directory_add("prospects", {"id": pid, "name": payload["name"], "email": payload["email"]})
+        return pid
     except Exception as e:
         if "name has already been taken" in str(e).lower():
-            pid = _find_prospect_by_name(payload["name"])
+            pid = _lookup("prospects_by_name", _norm_name(payload["name"])) or _find_prospect_by_name(payload["name"])
             if pid:
                 return pid
         raise
 
 
 def ensure_recipient(name: str, email: str, address_json: Dict[str, Any] | None) -> tuple[Optional[str], Optional[str]]:
+    if _directory_ready():
+        cid = _lookup("clients_by_email", _norm_email(email))
+        if cid:
+            return (cid, None)
+        pid = _lookup("prospects_by_email", _norm_email(email)) or _lookup("prospects_by_name", _norm_name(name))
+        if pid:
+            return (None, pid)
+
+    # absent de l'annuaire (créé depuis la dernière synchro, synchro KO, ...) ou annuaire
+    # indisponible : recherche distante avant toute création, pour ne pas créer de doublon
     cid = _find_by_email("clients", email)
     if cid:
+        with _DIRECTORY_LOCK:
+            _directory_add("clients", {"id": cid, "email": email})
         return (cid, None)
     pid = _find_by_email("prospects", email)
     if pid:
+        with _DIRECTORY_LOCK:
+            _directory_add("prospects", {"id": pid, "email": email})
         return (None, pid)
     pid = _find_prospect_by_name(name)
     if pid:
+        with _DIRECTORY_LOCK:
+            _directory_add("prospects", {"id": pid, "name": name})
         return (None, pid)
     return (None, _create_prospect(name, email, address_json))
 
@@ -185,7 +349,7 @@ def create_quote(
 
 
 def get_quote(qid: str) -> dict:
-    return _request("GET", settings.EVOLIZ_BASE_URL, f"/api/v1/companies/{settings.EVOLIZ_COMPANY_ID}/quotes/{qid}")
+    return hedged(lambda: _request("GET", settings.EVOLIZ_BASE_URL, f"/api/v1/companies/{settings.EVOLIZ_COMPANY_ID}/quotes/{qid}"))
 
 
 def extract_identifiers(quote_response: dict) -> Tuple[Optional[str], Optional[str]]:
@@ -264,6 +428,8 @@ def _issue_quote_if_needed(qid: str) -> None:
         try:
             _post(p, {})
             return
+        except DeadlineExceeded:
+            raise
         except Exception:
             continue
 
@@ -275,18 +441,30 @@ def _issue_quote_if_needed(qid: str) -> None:
             f"/api/v1/companies/{settings.EVOLIZ_COMPANY_ID}/quotes/{qid}",
             {"status": "issued"},
         )
+    except DeadlineExceeded:
+        raise
     except Exception:
         pass
 
 
 def download_quote_pdf(qid: str) -> tuple[bytes, str]:
+    """Télécharge le PDF du devis en mémoire (cf. open_quote_pdf pour le streaming)."""
+    r, filename = open_quote_pdf(qid)
+    try:
+        return r.content, filename
+    finally:
+        r.close()
+
+
+def open_quote_pdf(qid: str) -> tuple[requests.Response, str]:
     """
-    Télécharge le PDF du devis.
+    Ouvre le PDF du devis en streaming (réponse non lue + nom de fichier).
     - essaie plusieurs endpoints
     - si 404 → émet le devis → réessaie
     - bascule automatiquement sur EVOLIZ_APP_BASE_URL si nécessaire
+    - s'arrête (DeadlineExceeded) dès que le budget de la requête est épuisé
     """
-    def _try_download_one_host(base: str) -> tuple[bytes, str] | None:
+    def _try_download_one_host(base: str) -> tuple[requests.Response, str] | None:
         # liste étendue d’endpoints possibles
         candidates = [
             f"/api/v1/companies/{settings.EVOLIZ_COMPANY_ID}/quotes/{qid}/pdf",
@@ -298,14 +476,18 @@ def download_quote_pdf(qid: str) -> tuple[bytes, str]:
         ]
         last = None
         for path in candidates:
+            check_deadline(f"PDF devis {qid}")
             try:
-                content, cd = _get_bytes(base, path)
+                r = _open_binary(base, path)
+                cd = r.headers.get("content-disposition")
                 filename = f"devis_{qid}.pdf"
                 if cd:
                     m = re.search(r'filename="?([^"]+)"?', cd)
                     if m:
                         filename = m.group(1)
-                return content, filename
+                return r, filename
+            except DeadlineExceeded:
+                raise
             except Exception as e:
                 last = e
                 continue
@@ -329,6 +511,8 @@ def download_quote_pdf(qid: str) -> tuple[bytes, str]:
                     again = _try_download_one_host(host)
                     if again:
                         return again
+                except DeadlineExceeded:
+                    raise
                 except Exception:
                     continue
         else:
@@ -342,6 +526,8 @@ def download_quote_pdf(qid: str) -> tuple[bytes, str]:
             got2 = _try_download_one_host(host)
             if got2:
                 return got2
+        except DeadlineExceeded:
+            raise
         except Exception:
             pass
 
@@ -354,6 +540,8 @@ def download_quote_pdf(qid: str) -> tuple[bytes, str]:
             got3 = _try_download_one_host(host)
             if got3:
                 return got3
+        except DeadlineExceeded:
+            raise
         except Exception:
             pass
 
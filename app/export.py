@@ -0,0 +1,71 @@
+import csv
+import io
+import json
+from typing import Iterator
+
+from .boards import BoardConfig
+from .config import settings
+from .formulas import get_schema
+from .monday import iter_board_items
+from .snapshot import ItemSnapshot
+
+# ============================================================
+# Export streamé de l'état des paiements du board
+# ============================================================
+
+
+def export_columns(board: BoardConfig) -> list[tuple[str, str]]:
+    """(nom du champ exporté, id de colonne Monday), dans l'ordre de sortie."""
+    routes = board.routes
+    fields: list[tuple[str, str]] = []
+    for num in sorted(set(routes["formula_cols"]) | set(routes["link_columns"])):
+        if num in routes["formula_cols"]:
+            fields.append((f"acompte_{num}_amount", routes["formula_cols"][num]))
+        if num in routes["link_columns"]:
+            fields.append((f"acompte_{num}_link", routes["link_columns"][num]))
+    fields.append(("status", board.STATUS_COLUMN_ID))
+    if board.TRIGGER_STATUS_COLUMN_ID != board.STATUS_COLUMN_ID:
+        fields.append(("trigger_status", board.TRIGGER_STATUS_COLUMN_ID))
+    fields.append(("quote_amount", board.QUOTE_AMOUNT_FORMULA_ID))
+    return fields
+
+
+def _export_value(snap: ItemSnapshot, column_id: str) -> str:
+    # colonnes lien : l'URL de paiement plutôt que le libellé "Payer acompte N"
+    if snap.schema.col_types.get(column_id) == "link":
+        value = snap.value(column_id)
+        if isinstance(value, dict) and value.get("url"):
+            return str(value["url"])
+    return snap.text(column_id)
+
+
+def iter_payment_rows(board: BoardConfig) -> Iterator[dict]:
+    """Une ligne par item ; les pages items_page sont lues au fil de la consommation."""
+    fields = export_columns(board)
+    column_ids = sorted({cid for _, cid in fields})
+    schema = get_schema(board.board_id)
+    for item in iter_board_items(board.board_id, column_ids=column_ids, page_size=settings.EXPORT_PAGE_SIZE):
+        snap = ItemSnapshot.from_item(schema, item)
+        row = {"item_id": str(snap.item_id), "name": snap.name}
+        for field, cid in fields:
+            row[field] = _export_value(snap, cid)
+        yield row
+
+
+def iter_ndjson(board: BoardConfig) -> Iterator[bytes]:
+    for row in iter_payment_rows(board):
+        yield (json.dumps(row, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+def iter_csv(board: BoardConfig) -> Iterator[bytes]:
+    header = ["item_id", "name"] + [field for field, _ in export_columns(board)]
+    buf = io.StringIO()
+    writer = csv.DictWriter(buf, fieldnames=header)
+    writer.writeheader()
+    for row in iter_payment_rows(board):
+        writer.writerow(row)
+        yield buf.getvalue().encode("utf-8")
+        buf.seek(0)
+        buf.truncate(0)
+    if buf.tell():
+        yield buf.getvalue().encode("utf-8")
@@ -0,0 +1,219 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from .config import settings
+from .monday import (
+    formula_tokens,
+    get_board_columns_map,
+    get_item,
+    make_formula_resolver,
+)
+from .snapshot import ItemSnapshot
+
+# ============================================================
+# Schéma du board + graphe de dépendances des formules
+# ============================================================
+
+
+class BoardSchema:
+    """Colonnes du board, formules et graphe colonne -> formules dépendantes."""
+
+    def __init__(self, board_id: int, columns_map: tuple):
+        cols, id_to_title, title_to_id, formulas, col_types = columns_map
+        self.board_id = board_id
+        self.cols = cols
+        self.id_to_title = id_to_title
+        self.title_to_id = title_to_id
+        self.formulas = formulas
+        self.col_types = col_types
+        # position de chaque colonne : index des valeurs dans ItemSnapshot
+        self.column_ids: list[str] = [c["id"] for c in cols]
+        self.column_index: dict[str, int] = {cid: i for i, cid in enumerate(self.column_ids)}
+        # formule -> colonnes lues ; colonne -> formules qui la lisent directement
+        self.deps: dict[str, set[str]] = {}
+        self.dependents: dict[str, set[str]] = {}
+        for fid, expr in formulas.items():
+            inputs = {self.resolve_column_id(tk) for tk in formula_tokens(expr)}
+            self.deps[fid] = inputs
+            for cid in inputs:
+                self.dependents.setdefault(cid, set()).add(fid)
+
+    def resolve_column_id(self, token: str) -> str:
+        if token not in self.col_types and token in self.title_to_id:
+            return self.title_to_id[token]
+        return token
+
+    def inputs_of(self, formula_col_id: str) -> set[str]:
+        """Colonnes lues (directement ou via d'autres formules) par une formule."""
+        out: set[str] = set()
+        stack = [formula_col_id]
+        while stack:
+            for cid in self.deps.get(stack.pop(), ()):
+                if cid not in out:
+                    out.add(cid)
+                    stack.append(cid)
+        return out
+
+    def affected_by(self, column_id: str) -> set[str]:
+        """Formules impactées (directement ou transitivement) par un changement de column_id."""
+        out: set[str] = set()
+        stack = [column_id]
+        while stack:
+            for fid in self.dependents.get(stack.pop(), ()):
+                if fid not in out:
+                    out.add(fid)
+                    stack.append(fid)
+        return out
+
+
+_SCHEMAS: dict[int, tuple[float, BoardSchema]] = {}
+_SCHEMA_LOCK = threading.Lock()
+
+
+def get_schema(board_id: int | None = None, force: bool = False) -> BoardSchema:
+    board_id = int(board_id or settings.MONDAY_BOARD_ID)
+    cached = _SCHEMAS.get(board_id)
+    if cached and not force and time.monotonic() - cached[0] < settings.SCHEMA_TTL_SECONDS:
+        return cached[1]
+    columns_map = get_board_columns_map(board_id)
+    with _SCHEMA_LOCK:
+        previous = _SCHEMAS.get(board_id)
+        # schéma inchangé : on garde le même objet (les snapshots en cache restent valides)
+        if (
+            previous
+            and previous[1].column_ids == [c["id"] for c in columns_map[0]]
+            and previous[1].formulas == columns_map[3]
+            and previous[1].col_types == columns_map[4]
+        ):
+            schema = previous[1]
+        else:
+            schema = BoardSchema(board_id, columns_map)
+        _SCHEMAS[board_id] = (time.monotonic(), schema)
+    return schema
+
+
+# ============================================================
+# Cache des valeurs par item (entrées + formules calculées)
+# ============================================================
+
+
+# item_id -> (amorcé à, snapshot) ; au-delà de FORMULA_CACHE_TTL_SECONDS on relit l'item
+_ITEMS: "OrderedDict[int, tuple[float, ItemSnapshot]]" = OrderedDict()
+_ITEMS_LOCK = threading.Lock()
+
+
+def _resolver(snap: ItemSnapshot):
+    schema = snap.schema
+    return make_formula_resolver(
+        schema.formulas, schema.col_types, schema.title_to_id, snap.formula_input, snap.formulas
+    )
+
+
+def _store(snap: ItemSnapshot) -> None:
+    _ITEMS[snap.item_id] = (time.monotonic(), snap)
+    _ITEMS.move_to_end(snap.item_id)
+    while len(_ITEMS) > settings.FORMULA_CACHE_MAX_ITEMS:
+        _ITEMS.popitem(last=False)
+
+
+def _cached_entry(item_id: int, schema: BoardSchema) -> ItemSnapshot | None:
+    entry = _ITEMS.get(item_id)
+    if entry is None:
+        return None
+    stored_at, snap = entry
+    if snap.schema is not schema or time.monotonic() - stored_at > settings.FORMULA_CACHE_TTL_SECONDS:
+        # les événements de colonne ont pu être manqués : on ne sert pas une valeur trop ancienne
+        del _ITEMS[item_id]
+        return None
+    _ITEMS.move_to_end(item_id)
+    return snap
+
+
+def _same_inputs(cached: ItemSnapshot, snapshot: ItemSnapshot, column_ids: set[str]) -> bool:
+    return all(cached.formula_input(cid) == snapshot.formula_input(cid) for cid in column_ids)
+
+
+def get_formula_value(
+    formula_col_id: str, item_id: int, snapshot: ItemSnapshot | None = None, board_id: int | None = None
+) -> float | None:
+    """
+    Valeur d'une formule pour un item. Le cache (tenu à jour par les webhooks de
+    colonne) répond tant que ses entrées de la formule sont celles du `snapshot`
+    lu par l'appelant ; sinon le snapshot fait foi et réamorce le cache. Sans
+    snapshot ni cache frais : une seule lecture Monday.
+    """
+    schema = get_schema(board_id)
+    if formula_col_id not in schema.formulas:
+        return None
+    item_id = int(item_id)
+    if snapshot is not None and snapshot.schema is not schema:
+        snapshot = None
+    with _ITEMS_LOCK:
+        snap = _cached_entry(item_id, schema)
+        if snap is not None and (snapshot is None or _same_inputs(snap, snapshot, schema.inputs_of(formula_col_id))):
+            return _resolver(snap)(formula_col_id)
+    if snapshot is None:
+        snapshot = ItemSnapshot.from_item(schema, get_item(item_id), item_id)
+    with _ITEMS_LOCK:
+        _store(snapshot)
+        return _resolver(snapshot)(formula_col_id)
+
+
+# clés qui portent le texte affiché dans les valeurs webhook (lien, lieu, téléphone, email, date, nombre...)
+_EVENT_TEXT_KEYS = ("text", "address", "phone", "email", "url", "date", "value")
+
+
+def _event_value_text(value) -> str | None:
+    """
+    Texte d'une valeur de colonne telle qu'envoyée par un webhook Monday.
+    None : forme non reconnue, la valeur est à relire chez Monday.
+    """
+    if value is None:
+        return ""
+    if isinstance(value, dict):
+        lbl = value.get("label")
+        if isinstance(lbl, dict):
+            return str(lbl.get("text") or "")
+        if lbl:
+            return str(lbl)
+        for key in _EVENT_TEXT_KEYS:
+            v = value.get(key)
+            if isinstance(v, (str, int, float)) and not isinstance(v, bool) and v != "":
+                return str(v)
+        if not value or any(key in value for key in _EVENT_TEXT_KEYS):
+            return ""
+        return None
+    if isinstance(value, (str, int, float)):
+        return str(value)
+    return None
+
+
+def apply_column_change(item_id: int, column_id: str, value, board_id: int | None = None) -> list[str]:
+    """
+    Applique un changement de colonne (webhook Monday) au cache de l'item et ne
+    recalcule que les formules qui en dépendent. Un item absent du cache est ignoré :
+    il sera amorcé à la prochaine lecture.
+    """
+    schema = get_schema(board_id)
+    item_id = int(item_id)
+    with _ITEMS_LOCK:
+        snap = _cached_entry(item_id, schema)
+        if snap is None:
+            return []
+        if schema.col_types.get(column_id) == "formula":
+            return []
+        text = _event_value_text(value)
+        if text is None:
+            # valeur non décodable : l'item sera relu à la prochaine lecture
+            del _ITEMS[item_id]
+            return []
+        snap.set(column_id, text, json.dumps(value, ensure_ascii=False) if value is not None else "")
+        affected = schema.affected_by(column_id)
+        for fid in affected:
+            snap.formulas.pop(fid, None)
+        resolve = _resolver(snap)
+        for fid in affected:
+            resolve(fid)
+        return sorted(affected)
@@ -1,22 +1,130 @@
+import asyncio
+import hashlib
 import json
 import logging
 import re
-from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import JSONResponse
+import time
+from contextlib import asynccontextmanager
+from fastapi import BackgroundTasks, FastAPI, Request, HTTPException
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 
 from .config import settings
+from .boards import BoardConfig, board_configs, get_board
+from .resilience import (
+    CircuitOpenError,
+    DeadlineExceeded,
+    breakers_snapshot,
+    deadline,
+    deadline_exempt,
+    latency_snapshot,
+    remaining,
+)
 from .payments import _choose_api_key, cents_from_str, create_payment
 from .monday import (
-    get_item_columns,
     set_link_in_column,
     set_status,
-    compute_formula_value_for_item,
 )
-
-logging.basicConfig(level=logging.INFO)
+from .formulas import apply_column_change, get_formula_value, get_schema
+from .snapshot import ItemSnapshot
+from . import attachments, mirror, profiler
+from .export import iter_csv, iter_ndjson
+from .warmup import READINESS, run_warmup
+from .debounce import Debouncer
+from .prefetch import PLANS
+from .admission import PRIORITY_LINK, PRIORITY_PAYMENT, AdmissionRejected
+from . import replay
+from .tracing import TraceIdLogFilter, current_trace_id, find_trace, recent_traces, span, start_trace, to_otlp
+
+logging.basicConfig(level=logging.INFO, format="%(levelname)s:%(name)s:[%(trace_id)s] %(message)s")
+for _handler in logging.getLogger().handlers:
+    _handler.addFilter(TraceIdLogFilter())
 logger = logging.getLogger("energyz")
 
-app = FastAPI(title="Energyz PayPlug API", version="2.1 (robust IBAN + PP webhook)")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # warm-up en tâche de fond : / (liveness) répond tout de suite, /ready attend le warm-up
+    warmup = asyncio.create_task(run_warmup())
+    yield
+    warmup.cancel()
+
+
+STATUS_DEBOUNCER = Debouncer(settings.DEBOUNCE_WINDOW_MS / 1000.0)
+
+app = FastAPI(title="Energyz PayPlug API", version="2.1 (robust IBAN + PP webhook)", lifespan=lifespan)
+
+
+@app.middleware("http")
+async def record_webhooks(request: Request, call_next):
+    if not settings.RECORD_PATH or request.url.path not in replay.RECORDED_ROUTES:
+        return await call_next(request)
+    body = await request.body()
+    started, t = time.time(), time.monotonic()
+    capture, token = replay.start_capture()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        try:
+            replay.finish_capture(token, capture, request.url.path, request.method, body,
+                                  status, started, time.monotonic() - t)
+        except Exception as e:
+            logger.warning(f"[RECORD] écriture KO: {e}")
+
+
+# Routes appelées par Monday / PayPlug : au-delà du budget, l'appelant a déjà abandonné
+DEADLINE_ROUTES = ("/quote/from_monday", "/monday/column_change", "/payplug/webhook")
+
+
+@app.middleware("http")
+async def enforce_deadline(request: Request, call_next):
+    if request.url.path not in DEADLINE_ROUTES:
+        return await call_next(request)
+    budget = settings.REQUEST_BUDGET_SECONDS
+    # budget plus court transmis par l'appelant (ms)
+    header = request.headers.get("x-request-budget-ms")
+    if header and header.isdigit():
+        budget = min(budget, int(header) / 1000.0)
+    with deadline(budget):
+        return await call_next(request)
+
+
+@app.middleware("http")
+async def profile_requests(request: Request, call_next):
+    # X-Profile: 1 (+ jeton admin) : profil de cette requête seule, lisible via /debug/profiles/{trace_id}
+    wanted = request.headers.get("x-profile") == "1" and settings.ADMIN_TOKEN \
+        and request.headers.get("x-admin-token") == settings.ADMIN_TOKEN
+    if not wanted:
+        response = await call_next(request)
+        profiler.request_finished()
+        return response
+    session, token = profiler.start_request_profile()
+    try:
+        response = await call_next(request)
+    finally:
+        profile_id = current_trace_id() or "-"
+        profiler.finish_request_profile(profile_id, session, token)
+        profiler.request_finished()
+    response.headers["X-Profile-Id"] = profile_id
+    return response
+
+
+# Sondes (health, metrics) et lecture des traces : non tracées, elles évinceraient les webhooks du buffer
+UNTRACED_PATHS = ("/", "/ready", "/metrics")
+UNTRACED_PREFIXES = ("/health/", "/debug/")
+
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    path = request.url.path
+    if path in UNTRACED_PATHS or path.startswith(UNTRACED_PREFIXES):
+        return await call_next(request)
+    with start_trace(f"{request.method} {request.url.path}", request.headers.get("x-trace-id")) as trace:
+        response = await call_next(request)
+        trace.attributes["http.status_code"] = response.status_code
+    response.headers["X-Trace-Id"] = trace.trace_id
+    return response
 
 
 # ---------- Utils ----------
@@ -56,12 +164,47 @@ def _norm(s: str) -> str:
     return (s or "").strip().lower()
 
 
+def _require_admin(request: Request) -> None:
+    token = getattr(settings, "ADMIN_TOKEN", None)
+    if not token or request.headers.get("x-admin-token") != token:
+        raise HTTPException(status_code=403, detail="Accès admin refusé.")
+
+
+def _mirror_event(event: dict, subscribed: bool = False) -> None:
+    if not settings.MIRROR_ENABLED:
+        return
+    try:
+        mirror.apply_event(event, subscribed=subscribed)
+    except Exception as e:
+        logger.warning(f"[MIRROR] apply_event KO: {e}")
+
+
 # ---------- Health ----------
 @app.get("/")
 def root():
     return {"status": "ok", "message": "Energyz PayPlug API is live 🚀"}
 
 
+@app.get("/ready")
+def ready():
+    return JSONResponse(READINESS, status_code=200 if READINESS["ready"] else 503)
+
+
+@app.get("/health/upstreams")
+def health_upstreams():
+    return {"breakers": breakers_snapshot(), "latencies": latency_snapshot()}
+
+
+@app.get("/metrics")
+def metrics():
+    return {
+        "debounce": STATUS_DEBOUNCER.stats(),
+        "pdf_uploads": attachments.stats(),
+        "plans": PLANS.stats(),
+        "boards": {bid: board.stats() for bid, board in board_configs().items()},
+    }
+
+
 # ---------- Monday -> création lien ----------
 @app.post("/quote/from_monday")
 async def quote_from_monday(request: Request):
@@ -74,13 +217,22 @@ async def quote_from_monday(request: Request):
         item_id = event.get("pulseId") or event.get("itemId")
         if not item_id:
             raise HTTPException(status_code=400, detail="Item ID manquant (pulseId/itemId).")
+        board = get_board(event.get("boardId"))
+        if board is None:
+            raise HTTPException(status_code=404, detail=f"Board non configuré: {event.get('boardId')}.")
+        await asyncio.to_thread(_mirror_event, event)
 
         trigger_col = event.get("columnId")
-        trigger_status_col = getattr(settings, "TRIGGER_STATUS_COLUMN_ID", "status")
-        trigger_labels = _safe_json_loads(
-            getattr(settings, "TRIGGER_LABELS_JSON", None),
-            default={"1": "Acompte 1", "2": "Acompte 2"},
-        ) or {"1": "Acompte 1", "2": "Acompte 2"}
+        trigger_status_col = getattr(board, "TRIGGER_STATUS_COLUMN_ID", "status")
+
+        # Rafale de changements de statut sur le même item : seul le dernier est traité
+        if trigger_col == trigger_status_col:
+            with span("debounce"):
+                latest = await STATUS_DEBOUNCER.settle(str(item_id))
+            if not latest:
+                logger.info(f"[DEBOUNCE] item_id={item_id} événement remplacé par un plus récent")
+                return {"status": "coalesced", "item_id": item_id}
+        trigger_labels = board.routes["trigger_labels"]
 
         acompte_num = None
         if trigger_col == trigger_status_col:
@@ -94,157 +246,452 @@ async def quote_from_monday(request: Request):
                 acompte_num = "1" if "1" in current_label else ("2" if "2" in current_label else None)
 
         if acompte_num not in ("1", "2"):
-            raise HTTPException(status_code=400, detail="Label status non reconnu pour acompte 1/2.")
-
-        # Colonnes nécessaires
-        formula_cols = _safe_json_loads(settings.FORMULA_COLUMN_IDS_JSON, default={}) or {}
-        link_columns = _safe_json_loads(settings.LINK_COLUMN_IDS_JSON, default={}) or {}
-        if acompte_num not in formula_cols or acompte_num not in link_columns:
-            raise HTTPException(
-                status_code=500,
-                detail=f"FORMULA_COLUMN_IDS_JSON/LINK_COLUMN_IDS_JSON sans clé '{acompte_num}'.",
+            # statut qui précède un acompte : on prépare le paiement (schéma : appel Monday possible)
+            prepared = await asyncio.to_thread(
+                _speculate, board, int(item_id), trigger_col, _safe_json_loads(event.get("value"), default={})
             )
+            if prepared:
+                return {"status": "prefetching", "item_id": item_id, "acomptes": prepared}
+            raise HTTPException(status_code=400, detail="Label status non reconnu pour acompte 1/2.")
 
-        needed_cols = [
-            settings.EMAIL_COLUMN_ID,
-            settings.ADDRESS_COLUMN_ID,
-            settings.DESCRIPTION_COLUMN_ID,
-            settings.IBAN_FORMULA_COLUMN_ID,
-            settings.QUOTE_AMOUNT_FORMULA_ID,
-            formula_cols[acompte_num],
-            getattr(settings, "BUSINESS_STATUS_COLUMN_ID", "color_mkwnxf1h"),
-            "name",
-        ]
-        cols = get_item_columns(item_id, needed_cols)
-        logger.info(f"[MONDAY] item_id={item_id} values={cols}")
-
-        email = cols.get(settings.EMAIL_COLUMN_ID, "") or ""
-        address = cols.get(settings.ADDRESS_COLUMN_ID, "") or ""
-        description = cols.get(settings.DESCRIPTION_COLUMN_ID, "") or ""
-        iban = (cols.get(settings.IBAN_FORMULA_COLUMN_ID, "") or "").strip()
-
-        # ---------- Montant ----------
-        formula_id = formula_cols[acompte_num]
-        acompte_txt = _clean_number_text(cols.get(formula_id, ""))
-
-        if float(acompte_txt or "0") <= 0:
-            computed = compute_formula_value_for_item(formula_id, int(item_id))
-            if computed is not None and computed > 0:
-                acompte_txt = str(computed)
-
-        if float(acompte_txt or "0") <= 0:
-            total_ht_txt = _clean_number_text(cols.get(settings.QUOTE_AMOUNT_FORMULA_ID, "0"))
-            if float(total_ht_txt) > 0:
-                acompte_txt = str(float(total_ht_txt) / 2.0)
-            else:
-                raise HTTPException(
-                    status_code=400,
-                    detail="Montant introuvable (formula + recalcul + total HT vides).",
-                )
+        # Le reste (I/O bloquantes) tourne dans le pool du board, une fois admis par ce board
+        async with board.admission.slot(PRIORITY_LINK, remaining()):
+            return await board.run(_create_payment_link, board, item_id, acompte_num)
 
-        amount_cents = cents_from_str(acompte_txt)
-        if amount_cents <= 0:
-            raise HTTPException(status_code=400, detail=f"Montant invalide après parsing: '{acompte_txt}'.")
-
-        # ---------- IBAN : 3 niveaux de fallback ----------
-        # 0) IBAN forcé (si présent dans l'env) : FORCE_IBAN
-        forced_iban = getattr(settings, "FORCE_IBAN", "").strip()
-        if forced_iban:
-            iban = forced_iban
-            logger.info(f"[IBAN] Using FORCE_IBAN='{iban}'")
-
-        # 1) Si formule vide, on tente un mapping par Business Line (avec normalisation et matching souple)
-        if not iban:
-            business_col_id = getattr(settings, "BUSINESS_STATUS_COLUMN_ID", "color_mkwnxf1h")
-            business_label = (cols.get(business_col_id, "") or "").strip()
-
-            # mapping depuis l'env (clé: label BL, valeur: IBAN) + défauts codés
-            env_map = _safe_json_loads(getattr(settings, "IBAN_BY_STATUS_JSON", None), default={}) or {}
-            default_map = {
-                # défauts utiles si ton env est vide/incomplet
-                "energyz mar":    "FR76 1695 8000 0130 5670 5696 366",
-                "energyz divers": "FR76 1695 8000 0100 0571 1982 492",
-            }
-            # merge : l'env écrase les défauts
-            # (on normalise les clés ici pour matcher en minuscule partout)
-            merged = {**default_map, **{_norm(k): v for k, v in env_map.items()}}
-
-            bl = _norm(business_label)
-            chosen = ""
-            tried = []
-            for k, v in merged.items():
-                tried.append(k)
-                if not v:
-                    continue
-                # match exact / startswith / contains
-                if bl == k or bl.startswith(k) or (k in bl):
-                    chosen = v.strip()
-                    break
+    except HTTPException as e:
+        logger.error(f"[HTTP] {e.status_code} {e.detail}")
+        raise
+    except AdmissionRejected as e:
+        logger.warning(f"[ADMISSION] item_id={item_id} {e}")
+        raise HTTPException(
+            status_code=e.status_code,
+            detail=str(e),
+            headers={"Retry-After": str(int(e.retry_after) + 1)},
+        )
+    except CircuitOpenError as e:
+        logger.warning(f"[BREAKER] {e}")
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": str(int(e.retry_after) + 1)},
+        )
+    except DeadlineExceeded as e:
+        logger.warning(f"[DEADLINE] {e}")
+        raise HTTPException(status_code=504, detail=str(e))
+    except Exception as e:
+        logger.exception(f"[EXCEPTION] {e}")
+        raise HTTPException(status_code=500, detail=f"Erreur webhook Monday : {e}")
 
-            logger.info(f"[IBAN] business_label='{business_label}' (norm='{bl}') tried={tried} → chosen='{chosen}'")
-            if chosen:
-                iban = chosen
 
-        if not iban:
-            raise HTTPException(
-                status_code=400,
-                detail="IBAN introuvable (formule vide + pas de fallback Business Line).",
-            )
+def _plan_columns(board: BoardConfig, acompte_num: str) -> list[str]:
+    """Colonnes lues pour résoudre le paiement d'un acompte."""
+    return [
+        board.EMAIL_COLUMN_ID,
+        board.ADDRESS_COLUMN_ID,
+        board.DESCRIPTION_COLUMN_ID,
+        board.IBAN_FORMULA_COLUMN_ID,
+        board.QUOTE_AMOUNT_FORMULA_ID,
+        board.routes["formula_cols"][acompte_num],
+        getattr(board, "BUSINESS_STATUS_COLUMN_ID", "color_mkwnxf1h"),
+        "name",
+    ]
+
+
+def _plan_inputs(board: BoardConfig, acompte_num: str) -> list[str]:
+    """Entrées du plan : colonnes lues + entrées (transitives) de leurs formules."""
+    schema = get_schema(board.board_id)
+    inputs = set(_plan_columns(board, acompte_num))
+    for cid in list(inputs):
+        inputs |= schema.inputs_of(cid)
+    return sorted(inputs)
+
+
+def _plan_fingerprint(board: BoardConfig, acompte_num: str, snap: ItemSnapshot) -> str:
+    """Empreinte des valeurs des entrées du plan."""
+    values = [(cid, snap.get(cid, "")) for cid in _plan_inputs(board, acompte_num)]
+    return hashlib.sha256(json.dumps(values, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def _resolve_payment_plan(board: BoardConfig, item_id, acompte_num: str, snapshot: ItemSnapshot | None = None) -> dict:
+    """Lecture item -> montant -> IBAN -> clé PayPlug (bloquant, sans écriture)."""
+    # Colonnes nécessaires
+    routes = board.routes
+    formula_cols = routes["formula_cols"]
+    if acompte_num not in formula_cols or acompte_num not in routes["link_columns"]:
+        raise HTTPException(
+            status_code=500,
+            detail=f"FORMULA_COLUMN_IDS_JSON/LINK_COLUMN_IDS_JSON sans clé '{acompte_num}'.",
+        )
 
-        # ---------- Clé PayPlug ----------
-        api_key = _choose_api_key(iban)
-        if not api_key:
+    needed_cols = _plan_columns(board, acompte_num)
+    if snapshot is not None:
+        cols = snapshot
+    else:
+        with span("read_item", item_id=str(item_id)):
+            cols = mirror.get_item_columns(item_id, needed_cols, board_id=board.board_id)
+    logger.info(f"[MONDAY] item_id={item_id} values={cols.to_dict(needed_cols)}")
+
+    email = cols.get(board.EMAIL_COLUMN_ID, "") or ""
+    address = cols.get(board.ADDRESS_COLUMN_ID, "") or ""
+    description = cols.get(board.DESCRIPTION_COLUMN_ID, "") or ""
+    iban = (cols.get(board.IBAN_FORMULA_COLUMN_ID, "") or "").strip()
+
+    # ---------- Montant ----------
+    formula_id = formula_cols[acompte_num]
+    acompte_txt = _clean_number_text(cols.get(formula_id, ""))
+
+    if float(acompte_txt or "0") <= 0:
+        with span("formula_fallback", formula_id=formula_id):
+            computed = get_formula_value(formula_id, int(item_id), snapshot=cols, board_id=board.board_id)
+        if computed is not None and computed > 0:
+            acompte_txt = str(computed)
+
+    if float(acompte_txt or "0") <= 0:
+        total_ht_txt = _clean_number_text(cols.get(board.QUOTE_AMOUNT_FORMULA_ID, "0"))
+        if float(total_ht_txt) > 0:
+            acompte_txt = str(float(total_ht_txt) / 2.0)
+        else:
             raise HTTPException(
                 status_code=400,
-                detail=f"Aucune clé PayPlug mappée pour IBAN '{iban}' (mode={settings.PAYPLUG_MODE}).",
+                detail="Montant introuvable (formula + recalcul + total HT vides).",
             )
 
-        # ---------- Metadata riche ----------
-        metadata = {
-            "board_id": str(getattr(settings, "MONDAY_BOARD_ID", "")),
-            "item_id": str(item_id),
-            "item_name": cols.get("name", ""),
-            "acompte": acompte_num,
-            "description": description or f"Acompte {acompte_num}",
-            "source": "energyz-monday",
+    amount_cents = cents_from_str(acompte_txt)
+    if amount_cents <= 0:
+        raise HTTPException(status_code=400, detail=f"Montant invalide après parsing: '{acompte_txt}'.")
+
+    # ---------- IBAN : 3 niveaux de fallback ----------
+    # 0) IBAN forcé (si présent dans l'env) : FORCE_IBAN
+    forced_iban = getattr(board, "FORCE_IBAN", "").strip()
+    if forced_iban:
+        iban = forced_iban
+        logger.info(f"[IBAN] Using FORCE_IBAN='{iban}'")
+
+    # 1) Si formule vide, on tente un mapping par Business Line (avec normalisation et matching souple)
+    if not iban:
+        business_col_id = getattr(board, "BUSINESS_STATUS_COLUMN_ID", "color_mkwnxf1h")
+        business_label = (cols.get(business_col_id, "") or "").strip()
+
+        # mapping depuis l'env (clé: label BL, valeur: IBAN) + défauts codés
+        env_map = routes["iban_by_status"]
+        default_map = {
+            # défauts utiles si ton env est vide/incomplet
+            "energyz mar":    "FR76 1695 8000 0130 5670 5696 366",
+            "energyz divers": "FR76 1695 8000 0100 0571 1982 492",
         }
+        # merge : l'env écrase les défauts
+        # (on normalise les clés ici pour matcher en minuscule partout)
+        merged = {**default_map, **{_norm(k): v for k, v in env_map.items()}}
+
+        bl = _norm(business_label)
+        chosen = ""
+        tried = []
+        for k, v in merged.items():
+            tried.append(k)
+            if not v:
+                continue
+            # match exact / startswith / contains
+            if bl == k or bl.startswith(k) or (k in bl):
+                chosen = v.strip()
+                break
+
+        logger.info(f"[IBAN] business_label='{business_label}' (norm='{bl}') tried={tried} → chosen='{chosen}'")
+        if chosen:
+            iban = chosen
+
+    if not iban:
+        raise HTTPException(
+            status_code=400,
+            detail="IBAN introuvable (formule vide + pas de fallback Business Line).",
+        )
+
+    # ---------- Clé PayPlug ----------
+    api_key = _choose_api_key(iban, routes["payplug_keys"])
+    if not api_key:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Aucune clé PayPlug mappée pour IBAN '{iban}' (mode={board.PAYPLUG_MODE}).",
+        )
 
-        # ---------- Création paiement ----------
+    return {
+        "amount_cents": amount_cents,
+        "iban": iban,
+        "api_key": api_key,
+        "email": email,
+        "address": address,
+        "description": description,
+        "name": cols.get("name", ""),
+        "fingerprint": _plan_fingerprint(board, acompte_num, cols),
+    }
+
+
+def _create_payment_link(board: BoardConfig, item_id, acompte_num: str) -> dict:
+    """Plan de paiement (pré-résolu ou lu maintenant) -> paiement PayPlug -> écriture Monday (bloquant)."""
+    plan = PLANS.take(board.board_id, item_id, acompte_num) if settings.SPECULATIVE_PLANS else None
+    if plan is not None:
+        # les événements de colonne ne couvrent pas tout (lookup / mirror, abonnement absent) :
+        # les entrées du plan sont relues dans le miroir s'il est frais, sinon chez Monday
+        with span("plan_recheck", item_id=str(item_id)):
+            fresh = mirror.get_item_columns(item_id, _plan_inputs(board, acompte_num), board_id=board.board_id)
+        if _plan_fingerprint(board, acompte_num, fresh) == plan["fingerprint"]:
+            logger.info(f"[PLAN] item_id={item_id} acompte={acompte_num} plan pré-résolu utilisé")
+        else:
+            logger.info(f"[PLAN] item_id={item_id} acompte={acompte_num} entrées modifiées, plan recalculé")
+            plan = _resolve_payment_plan(board, item_id, acompte_num, snapshot=fresh)
+    else:
+        plan = _resolve_payment_plan(board, item_id, acompte_num)
+    routes = board.routes
+    link_columns = routes["link_columns"]
+    amount_cents = plan["amount_cents"]
+
+    # ---------- Metadata riche ----------
+    metadata = {
+        "board_id": str(board.board_id),
+        "item_id": str(item_id),
+        "item_name": plan["name"],
+        "acompte": acompte_num,
+        "description": plan["description"] or f"Acompte {acompte_num}",
+        "source": "energyz-monday",
+        "trace_id": current_trace_id() or "",
+    }
+
+    # ---------- Création paiement ----------
+    with span("create_payment", amount_cents=amount_cents):
         payment_url = create_payment(
-            api_key=api_key,
+            api_key=plan["api_key"],
             amount_cents=amount_cents,
-            email=email,
-            address=address,
-            client_name=cols.get("name", "Client Energyz"),
+            email=plan["email"],
+            address=plan["address"],
+            client_name=plan["name"] or "Client Energyz",
             metadata=metadata,
         )
 
-        set_link_in_column(item_id, link_columns[acompte_num], payment_url, f"Payer acompte {acompte_num}")
-
-        # Tu peux laisser le statut tel quel et le passer à "Payé ..." via webhook PayPlug,
-        # ou bien le mettre tout de suite après création (comme ci-dessous) :
-        status_after = _safe_json_loads(settings.STATUS_AFTER_PAY_JSON, default={}) or {}
-        next_status = status_after.get(acompte_num, f"Payé acompte {acompte_num}")
-        set_status(item_id, settings.STATUS_COLUMN_ID, next_status)
+    # Le paiement existe : l'écriture Monday se fait hors deadline (un 504 ferait réessayer
+    # Monday, donc créer un second paiement), et un échec est journalisé avec l'URL
+    status_after = routes["status_after"]
+    next_status = status_after.get(acompte_num, f"Payé acompte {acompte_num}")
+    try:
+        with deadline_exempt():
+            with span("write_link"):
+                set_link_in_column(
+                    item_id, link_columns[acompte_num], payment_url, f"Payer acompte {acompte_num}",
+                    board_id=board.board_id,
+                )
 
-        logger.info(f"[OK] item={item_id} acompte={acompte_num} amount_cents={amount_cents} url={payment_url}")
+            # Tu peux laisser le statut tel quel et le passer à "Payé ..." via webhook PayPlug,
+            # ou bien le mettre tout de suite après création (comme ci-dessous) :
+            with span("write_status"):
+                set_status(item_id, board.STATUS_COLUMN_ID, next_status, board_id=board.board_id)
+    except Exception as e:
+        logger.error(
+            f"[WRITE-BACK] item={item_id} acompte={acompte_num} paiement créé mais Monday non mis à jour "
+            f"({e}) url={payment_url}"
+        )
         return {
-            "status": "ok",
+            "status": "monday_update_failed",
             "item_id": item_id,
             "acompte": acompte_num,
             "amount_cents": amount_cents,
             "payment_url": payment_url,
         }
 
-    except HTTPException as e:
-        logger.error(f"[HTTP] {e.status_code} {e.detail}")
-        raise
+    logger.info(f"[OK] item={item_id} acompte={acompte_num} amount_cents={amount_cents} url={payment_url}")
+    return {
+        "status": "ok",
+        "item_id": item_id,
+        "acompte": acompte_num,
+        "amount_cents": amount_cents,
+        "payment_url": payment_url,
+    }
+
+
+def _speculate(board: BoardConfig, item_id: int, column_id: str | None, value) -> list[str]:
+    """
+    Mode SPECULATIVE_PLANS : un changement de colonne d'entrée invalide les plans de
+    l'item ; un statut qui précède un acompte, ou une entrée du montant qui change,
+    relance la résolution en tâche de fond. Renvoie les acomptes (re)planifiés.
+    """
+    if not settings.SPECULATIVE_PLANS or not column_id:
+        return []
+    routes = board.routes
+    acomptes = [a for a in routes["formula_cols"] if a in routes["link_columns"]]
+    if column_id == getattr(board, "TRIGGER_STATUS_COLUMN_ID", "status"):
+        label = _norm(_extract_status_label(value if isinstance(value, dict) else {}))
+        todo = [a for a, lbl in routes["prefetch_labels"].items() if a in acomptes and label == _norm(lbl)]
+    else:
+        touched = {column_id} | get_schema(board.board_id).affected_by(column_id)
+        if not any(touched & set(_plan_columns(board, a)) for a in acomptes):
+            return []
+        dropped = PLANS.invalidate(board.board_id, item_id)
+        todo = [a for a in acomptes if a in dropped or routes["formula_cols"][a] in touched]
+    for acompte in todo:
+        PLANS.schedule(board.board_id, item_id, acompte, _resolve_payment_plan, board, item_id, acompte)
+    return todo
+
+
+# ---------- Monday -> changement de colonne (cache formules) ----------
+@app.post("/monday/column_change")
+async def monday_column_change(request: Request):
+    payload = await request.json()
+    if "challenge" in payload:
+        return {"challenge": payload["challenge"]}
+    event = payload.get("event") or {}
+    item_id = event.get("pulseId") or event.get("itemId")
+    column_id = event.get("columnId")
+    if not item_id:
+        return {"ok": True, "ignored": True}
+    board = get_board(event.get("boardId"))
+    if board is None:
+        return {"ok": True, "ignored": True}
+    # SQLite + schéma (appel Monday à l'expiration du TTL) : hors de la boucle d'événements
+    return await asyncio.to_thread(_apply_column_event, board, int(item_id), column_id, event)
+
+
+def _apply_column_event(board: BoardConfig, item_id: int, column_id: str | None, event: dict) -> dict:
+    """Événement de l'abonnement du miroir : miroir, cache des formules, plans pré-résolus (bloquant)."""
+    _mirror_event(event, subscribed=True)
+    if not column_id:
+        return {"ok": True}
+    value = _safe_json_loads(event.get("value"), default=None)
+    try:
+        recomputed = apply_column_change(item_id, column_id, value, board_id=board.board_id)
     except Exception as e:
-        logger.exception(f"[EXCEPTION] {e}")
-        raise HTTPException(status_code=500, detail=f"Erreur webhook Monday : {e}")
+        logger.exception(f"[FORMULA-CACHE] item_id={item_id} column={column_id}: {e}")
+        return {"ok": False}
+    logger.info(f"[FORMULA-CACHE] item_id={item_id} column={column_id} recomputed={recomputed}")
+    try:
+        _speculate(board, item_id, column_id, value)
+    except Exception as e:
+        logger.warning(f"[PLAN] item_id={item_id} column={column_id}: {e}")
+    return {"ok": True, "recomputed": recomputed}
+
+
+# ---------- Monday -> PDF du devis dans la colonne fichier ----------
+@app.post("/quote/attach_pdf")
+async def quote_attach_pdf(request: Request):
+    """Webhook sur la colonne 'id devis' : le PDF Evoliz est copié dans la colonne fichier, en tâche de fond."""
+    payload = await request.json()
+    if "challenge" in payload:
+        return {"challenge": payload["challenge"]}
+    event = payload.get("event") or {}
+    item_id = event.get("pulseId") or event.get("itemId")
+    board = get_board(event.get("boardId"))
+    if not item_id or board is None or not board.QUOTE_PDF_COLUMN_ID:
+        return {"ok": True, "ignored": True}
+    if board.QUOTE_ID_COLUMN_ID and event.get("columnId") not in (None, board.QUOTE_ID_COLUMN_ID):
+        return {"ok": True, "ignored": True}
+    value = _safe_json_loads(event.get("value"), default={}) or {}
+    quote_id = str(value.get("value") or value.get("text") or "").strip() if isinstance(value, dict) else str(value)
+    if not quote_id:
+        return {"ok": True, "ignored": True}
+    attachments.schedule_quote_pdf(int(item_id), quote_id, board.QUOTE_PDF_COLUMN_ID)
+    return {"ok": True, "scheduled": True, "item_id": item_id, "quote_id": quote_id}
+
+
+# ---------- Admin : miroir du board ----------
+@app.post("/admin/mirror/seed")
+def admin_mirror_seed(request: Request, background: BackgroundTasks, board_id: int | None = None):
+    _require_admin(request)
+    background.add_task(mirror.seed, board_id)
+    return {"ok": True, "scheduled": True}
+
+
+@app.post("/admin/mirror/subscribe")
+def admin_mirror_subscribe(request: Request, board_id: int | None = None):
+    _require_admin(request)
+    return {"ok": True, "webhooks": mirror.subscribe(settings.PUBLIC_BASE_URL, board_id)}
+
+
+@app.get("/admin/mirror")
+def admin_mirror_stats(request: Request, board_id: int | None = None):
+    _require_admin(request)
+    return mirror.stats(board_id)
+
+
+# ---------- Export : état des paiements du board ----------
+@app.get("/export/payments")
+def export_payments(request: Request, format: str = "ndjson", board_id: int | None = None):
+    _require_admin(request)
+    board = get_board(board_id)
+    if board is None:
+        raise HTTPException(status_code=404, detail="Board non configuré.")
+    if format == "csv":
+        return StreamingResponse(
+            iter_csv(board),
+            media_type="text/csv; charset=utf-8",
+            headers={"Content-Disposition": 'attachment; filename="payments.csv"'},
+        )
+    if format == "ndjson":
+        return StreamingResponse(iter_ndjson(board), media_type="application/x-ndjson")
+    raise HTTPException(status_code=400, detail="Format inconnu (ndjson | csv).")
+
+
+# ---------- Debug : traces récentes ----------
+@app.get("/debug/traces")
+def debug_traces(request: Request, limit: int = 50, format: str = "summary"):
+    _require_admin(request)
+    traces = recent_traces(limit)
+    if format == "otlp":
+        return to_otlp(traces)
+    return {"traces": [t.summary() for t in traces]}
+
+
+@app.get("/debug/traces/{trace_id}")
+def debug_trace(trace_id: str, request: Request, format: str = "json"):
+    _require_admin(request)
+    trace = find_trace(trace_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail="Trace inconnue (sortie du buffer ?).")
+    return to_otlp([trace]) if format == "otlp" else trace.to_dict()
+
+
+# ---------- Admin : profiler par échantillonnage ----------
+@app.post("/admin/profile")
+async def admin_profile(request: Request, seconds: float | None = None, requests: int | None = None):
+    """
+    Échantillonne tous les threads pendant `seconds` secondes ou jusqu'à `requests`
+    requêtes traitées (plafonné à PROFILE_MAX_SECONDS) ; renvoie les piles collapsed.
+    """
+    _require_admin(request)
+    if not seconds and not requests:
+        raise HTTPException(status_code=400, detail="Préciser seconds ou requests.")
+    if profiler.ACTIVE["global"] is not None:
+        raise HTTPException(status_code=409, detail="Un profilage est déjà en cours.")
+    session = profiler.ProfileSession(max_requests=requests)
+    profiler.ACTIVE["global"] = profiler.start(session)
+    try:
+        limit = min(seconds or settings.PROFILE_MAX_SECONDS, settings.PROFILE_MAX_SECONDS)
+        await asyncio.to_thread(session.done.wait, limit)
+    finally:
+        profiler.stop(session)
+        profiler.ACTIVE["global"] = None
+    logger.info(f"[PROFILE] {session.summary()}")
+    return PlainTextResponse(session.collapsed(), headers={"X-Profile-Samples": str(session.samples)})
+
+
+@app.get("/debug/profiles/{profile_id}")
+def debug_profile(profile_id: str, request: Request):
+    _require_admin(request)
+    session = profiler.PROFILES.get(profile_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Profil inconnu (sorti du buffer ?).")
+    return PlainTextResponse(session.collapsed(), headers={"X-Profile-Samples": str(session.samples)})
 
 
 # ---------- PayPlug -> Webhook paiement réussi ----------
+# délai suggéré à PayPlug quand le budget de la requête est épuisé (s)
+PAYPLUG_DEADLINE_RETRY_AFTER = 5.0
+
+
+def _payplug_retry(reason: str, status_code: int, retry_after: float) -> JSONResponse:
+    """Réponse non-2xx : PayPlug renverra la notification après Retry-After."""
+    return JSONResponse(
+        {"ok": False, "error": reason},
+        status_code=status_code,
+        headers={"Retry-After": str(int(retry_after) + 1)},
+    )
+
+
 @app.post("/payplug/webhook")
 async def payplug_webhook(request: Request):
     try:
@@ -269,11 +716,26 @@ async def payplug_webhook(request: Request):
         item_id = metadata.get("item_id")
         acompte = metadata.get("acompte")
         if item_id and acompte in ("1", "2"):
-            status_after = _safe_json_loads(settings.STATUS_AFTER_PAY_JSON, default={}) or {}
-            next_status = status_after.get(acompte, f"Payé acompte {acompte}")
+            board = get_board(metadata.get("board_id")) or get_board()
+            next_status = board.routes["status_after"].get(acompte, f"Payé acompte {acompte}")
             try:
-                set_status(int(item_id), settings.STATUS_COLUMN_ID, next_status)
+                # prioritaire sur la création de liens du board ; hors pool du board pour ne pas attendre derrière eux
+                async with board.admission.slot(PRIORITY_PAYMENT, remaining()):
+                    await asyncio.to_thread(
+                        profiler.run_tracked, set_status, int(item_id), board.STATUS_COLUMN_ID, next_status, board_id=board.board_id
+                    )
                 logger.info(f"[PP-WEBHOOK] set_status OK item_id={item_id} -> '{next_status}'")
+            except AdmissionRejected as e:
+                # PayPlug renverra la notification
+                logger.warning(f"[PP-WEBHOOK] item_id={item_id} {e}")
+                return _payplug_retry(e.reason, e.status_code, e.retry_after)
+            except CircuitOpenError as e:
+                # Monday coupé : statut non posé, PayPlug doit renvoyer la notification
+                logger.warning(f"[PP-WEBHOOK] item_id={item_id} {e}")
+                return _payplug_retry("upstream_unavailable", 503, e.retry_after)
+            except DeadlineExceeded as e:
+                logger.warning(f"[PP-WEBHOOK] item_id={item_id} {e}")
+                return _payplug_retry("deadline_exceeded", 503, PAYPLUG_DEADLINE_RETRY_AFTER)
             except Exception as e:
                 logger.exception(f"[PP-WEBHOOK] set_status FAILED item_id={item_id}: {e}")
                 return JSONResponse({"ok": False, "error": "monday_update_failed"}, status_code=200)
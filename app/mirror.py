@@ -0,0 +1,280 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+from .config import settings
+from .formulas import _event_value_text, get_schema
+from .monday import (
+    _extract_text_from_column,
+    create_webhook,
+    get_item,
+    iter_board_items,
+)
+from .snapshot import ItemSnapshot
+
+logger = logging.getLogger("energyz.mirror")
+
+# ============================================================
+# Miroir local (SQLite) du board Monday
+# ============================================================
+#
+# - amorcé par un scan complet items_page
+# - tenu à jour par les webhooks change_column_value / create_item
+# - lecture locale si le miroir est frais, sinon lecture Monday (qui rafraîchit le miroir)
+
+_DDL = """
+CREATE TABLE IF NOT EXISTS mirror_boards (
+    board_id      INTEGER PRIMARY KEY,
+    seeded_at     REAL,
+    last_event_at REAL
+);
+CREATE TABLE IF NOT EXISTS mirror_items (
+    board_id       INTEGER NOT NULL,
+    item_id        INTEGER NOT NULL,
+    name           TEXT NOT NULL DEFAULT '',
+    synced_at      REAL NOT NULL,
+    PRIMARY KEY (board_id, item_id)
+);
+CREATE TABLE IF NOT EXISTS mirror_values (
+    board_id  INTEGER NOT NULL,
+    item_id   INTEGER NOT NULL,
+    column_id TEXT NOT NULL,
+    text      TEXT NOT NULL DEFAULT '',
+    value     TEXT NOT NULL DEFAULT '',
+    PRIMARY KEY (board_id, item_id, column_id)
+);
+CREATE INDEX IF NOT EXISTS idx_mirror_values_column ON mirror_values (board_id, column_id);
+"""
+
+_CONN: list[sqlite3.Connection | None] = [None]
+_LOCK = threading.RLock()
+
+
+def _db() -> sqlite3.Connection:
+    if _CONN[0] is None:
+        conn = sqlite3.connect(settings.MIRROR_DB_PATH, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(_DDL)
+        _CONN[0] = conn
+    return _CONN[0]
+
+
+def _board(board_id: int | None) -> int:
+    return int(board_id or settings.MONDAY_BOARD_ID)
+
+
+def _upsert_item(conn: sqlite3.Connection, board_id: int, item: dict, now: float) -> None:
+    item_id = int(item["id"])
+    conn.execute(
+        "INSERT INTO mirror_items (board_id, item_id, name, synced_at) VALUES (?, ?, ?, ?) "
+        "ON CONFLICT (board_id, item_id) DO UPDATE SET name = excluded.name, synced_at = excluded.synced_at",
+        (board_id, item_id, item.get("name") or "", now),
+    )
+    conn.executemany(
+        "INSERT OR REPLACE INTO mirror_values (board_id, item_id, column_id, text, value) VALUES (?, ?, ?, ?, ?)",
+        [
+            (board_id, item_id, col["id"], _extract_text_from_column(col), col.get("value") or "")
+            for col in item.get("column_values") or []
+        ],
+    )
+
+
+def seed(board_id: int | None = None) -> int:
+    """Scan complet du board (pagination items_page) vers le miroir."""
+    board_id = _board(board_id)
+    count = 0
+    batch: list[dict] = []
+    conn = _db()
+
+    def flush():
+        with _LOCK:
+            conn.execute("BEGIN")
+            now = time.time()
+            for it in batch:
+                _upsert_item(conn, board_id, it, now)
+            conn.execute("COMMIT")
+        batch.clear()
+
+    for item in iter_board_items(board_id, page_size=settings.MIRROR_PAGE_SIZE):
+        batch.append(item)
+        count += 1
+        if len(batch) >= settings.MIRROR_PAGE_SIZE:
+            flush()
+    if batch:
+        flush()
+    with _LOCK:
+        conn.execute(
+            "INSERT INTO mirror_boards (board_id, seeded_at) VALUES (?, ?) "
+            "ON CONFLICT (board_id) DO UPDATE SET seeded_at = excluded.seeded_at",
+            (board_id, time.time()),
+        )
+    logger.info(f"[MIRROR] board={board_id} seeded items={count}")
+    return count
+
+
+def subscribe(public_base_url: str, board_id: int | None = None) -> dict:
+    """Abonne le miroir aux webhooks Monday (changement de colonne / création d'item)."""
+    url = f"{public_base_url.rstrip('/')}/monday/column_change"
+    return {event: create_webhook(url, event, board_id) for event in ("change_column_value", "create_item")}
+
+
+def apply_event(event: dict, board_id: int | None = None, subscribed: bool = False) -> bool:
+    """
+    Applique un événement webhook Monday au miroir. Renvoie False si non pris en compte.
+    Seuls les événements de l'abonnement du miroir (subscribed=True, /monday/column_change)
+    prouvent qu'il est tenu à jour : les autres webhooks (déclencheur de statut) ne
+    rafraîchissent pas last_event_at.
+    """
+    board_id = _board(event.get("boardId") or board_id)
+    item_id = event.get("pulseId") or event.get("itemId")
+    if not item_id:
+        return False
+    item_id = int(item_id)
+    etype = event.get("type") or ""
+    now = time.time()
+    conn = _db()
+    column_id = event.get("columnId")
+    # schéma lu hors verrou : il peut déclencher un appel Monday
+    affected = get_schema(board_id).affected_by(column_id) if column_id and etype != "create_pulse" else set()
+    with _LOCK:
+        if subscribed:
+            conn.execute(
+                "INSERT INTO mirror_boards (board_id, last_event_at) VALUES (?, ?) "
+                "ON CONFLICT (board_id) DO UPDATE SET last_event_at = excluded.last_event_at",
+                (board_id, now),
+            )
+        if etype == "create_pulse":
+            columns = event.get("columnValues") or {}
+            _upsert_item(conn, board_id, {
+                "id": item_id,
+                "name": event.get("pulseName") or "",
+                # valeurs non décodables laissées absentes : relues chez Monday
+                "column_values": [
+                    {"id": cid, "text": text, "value": json.dumps(v, ensure_ascii=False)}
+                    for cid, v in columns.items()
+                    if (text := _event_value_text(v)) is not None
+                ],
+            }, now)
+            return True
+        exists = conn.execute(
+            "SELECT 1 FROM mirror_items WHERE board_id = ? AND item_id = ?", (board_id, item_id)
+        ).fetchone()
+        if not exists:
+            return False
+        if etype == "update_name":
+            value = event.get("value") or {}
+            name = value.get("name") if isinstance(value, dict) else value
+            conn.execute(
+                "UPDATE mirror_items SET name = ? WHERE board_id = ? AND item_id = ?",
+                (str(name or ""), board_id, item_id),
+            )
+            return True
+        if not column_id:
+            return False
+        value = event.get("value")
+        if isinstance(value, str):
+            try:
+                value = json.loads(value)
+            except Exception:
+                pass
+        text = _event_value_text(value)
+        if text is None:
+            # forme de valeur non reconnue : plutôt qu'un JSON brut en guise de texte,
+            # la colonne est retirée et la prochaine lecture de l'item passe par Monday
+            conn.execute(
+                "DELETE FROM mirror_values WHERE board_id = ? AND item_id = ? AND column_id = ?",
+                (board_id, item_id, column_id),
+            )
+        else:
+            conn.execute(
+                "INSERT OR REPLACE INTO mirror_values (board_id, item_id, column_id, text, value) VALUES (?, ?, ?, ?, ?)",
+                (board_id, item_id, column_id, text, json.dumps(value, ensure_ascii=False) if value is not None else ""),
+            )
+        # Monday n'émet pas d'événement pour les formules : celles qui dépendent de
+        # la colonne modifiée sont retirées du miroir et seront relues en direct.
+        if affected:
+            conn.executemany(
+                "DELETE FROM mirror_values WHERE board_id = ? AND item_id = ? AND column_id = ?",
+                [(board_id, item_id, fid) for fid in affected],
+            )
+    return True
+
+
+def _is_fresh(conn: sqlite3.Connection, board_id: int) -> bool:
+    row = conn.execute(
+        "SELECT seeded_at, last_event_at FROM mirror_boards WHERE board_id = ?", (board_id,)
+    ).fetchone()
+    if not row or not row[0]:
+        return False
+    latest = max(row[0] or 0, row[1] or 0)
+    return time.time() - latest <= settings.MIRROR_MAX_AGE_SECONDS
+
+
+def _read_local(board_id: int, item_id: int, column_ids: list[str]) -> ItemSnapshot | None:
+    conn = _db()
+    with _LOCK:
+        if not _is_fresh(conn, board_id):
+            return None
+        row = conn.execute(
+            "SELECT name FROM mirror_items WHERE board_id = ? AND item_id = ?", (board_id, item_id)
+        ).fetchone()
+        if not row:
+            return None
+        # toutes les colonnes de l'item : le snapshot sert aussi au moteur de formules
+        rows = conn.execute(
+            "SELECT column_id, text, value FROM mirror_values WHERE board_id = ? AND item_id = ?",
+            (board_id, item_id),
+        ).fetchall()
+    schema = get_schema(board_id)
+    snap = ItemSnapshot(schema, item_id, row[0])
+    for cid, text, value in rows:
+        snap.set(cid, text, value)
+    # colonne demandée absente (formule invalidée, valeur non décodée) : lecture Monday
+    if any(cid in schema.column_index and not snap.has(cid) for cid in column_ids):
+        return None
+    return snap
+
+
+def get_item_columns(item_id: int, column_ids: list[str], board_id: int | None = None) -> ItemSnapshot:
+    """
+    Snapshot de l'item, servi par le miroir quand il est frais.
+    Sinon : lecture Monday, puis rafraîchissement de l'item.
+    """
+    board_id = _board(board_id)
+    item_id = int(item_id)
+    if settings.MIRROR_ENABLED:
+        try:
+            local = _read_local(board_id, item_id, column_ids)
+            if local is not None:
+                return local
+        except Exception as e:
+            logger.warning(f"[MIRROR] lecture locale KO item_id={item_id}: {e}")
+    item = get_item(item_id)
+    if settings.MIRROR_ENABLED:
+        try:
+            with _LOCK:
+                _upsert_item(_db(), board_id, {**item, "id": item_id}, time.time())
+        except Exception as e:
+            logger.warning(f"[MIRROR] rafraîchissement KO item_id={item_id}: {e}")
+    return ItemSnapshot.from_item(get_schema(board_id), item, item_id)
+
+
+def stats(board_id: int | None = None) -> dict:
+    board_id = _board(board_id)
+    conn = _db()
+    with _LOCK:
+        row = conn.execute(
+            "SELECT seeded_at, last_event_at FROM mirror_boards WHERE board_id = ?", (board_id,)
+        ).fetchone()
+        items = conn.execute("SELECT COUNT(*) FROM mirror_items WHERE board_id = ?", (board_id,)).fetchone()[0]
+        fresh = _is_fresh(conn, board_id)
+    return {
+        "board_id": board_id,
+        "items": items,
+        "seeded_at": row[0] if row else None,
+        "last_event_at": row[1] if row else None,
+        "fresh": fresh,
+    }
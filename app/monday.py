@@ -1,17 +1,25 @@
+import io
 import json
 import re
 import math
-import requests
+import secrets
+from functools import lru_cache
 from .config import settings
+from .resilience import guarded_request, hedged
 
 MONDAY_API_URL = "https://api.monday.com/v2"
+MONDAY_FILE_API_URL = "https://api.monday.com/v2/file"
 HEADERS = {
     "Authorization": settings.MONDAY_API_KEY,
     "Content-Type": "application/json"
 }
 
-def _post(query: str, variables: dict):
-    resp = requests.post(MONDAY_API_URL, headers=HEADERS, json={"query": query, "variables": variables})
+def _post(query: str, variables: dict, operation: str):
+    # operation : une seule URL GraphQL, mais des latences (et timeouts adaptatifs) par opération
+    resp = guarded_request(
+        "monday", "POST", MONDAY_API_URL, operation=operation,
+        headers=HEADERS, json={"query": query, "variables": variables},
+    )
     resp.raise_for_status()
     data = resp.json()
     if "errors" in data and data["errors"]:
@@ -36,7 +44,7 @@ def _extract_text_from_column(col: dict) -> str:
         return json.dumps(parsed, ensure_ascii=False)
     return str(parsed)
 
-def get_item_columns(item_id: int, column_ids: list[str]) -> dict:
+def get_item(item_id: int) -> dict:
     query = """
     query ($item_id: ID!) {
       items (ids: [$item_id]) {
@@ -50,16 +58,60 @@ def get_item_columns(item_id: int, column_ids: list[str]) -> dict:
       }
     }
     """
-    data = _post(query, {"item_id": item_id})
-    item = data["data"]["items"][0]
-    result = {"name": item["name"]}
-    for col in item["column_values"]:
-        if col["id"] in column_ids:
-            result[col["id"]] = _extract_text_from_column(col)
-            result[col["id"] + "__raw"] = col.get("value") or ""
-    return result
-
-def get_board_columns_map():
+    data = hedged(lambda: _post(query, {"item_id": item_id}, "get_item"))
+    return data["data"]["items"][0]
+
+def iter_board_items(board_id: int | None = None, column_ids: list[str] | None = None, page_size: int = 500):
+    """Parcourt tous les items du board via la pagination par curseur (items_page)."""
+    first = """
+    query ($board_id: [ID!], $limit: Int!, $column_ids: [String!]) {
+      boards (ids: $board_id) {
+        items_page (limit: $limit) {
+          cursor
+          items { id name column_values (ids: $column_ids) { id type text value } }
+        }
+      }
+    }
+    """
+    following = """
+    query ($cursor: String!, $limit: Int!, $column_ids: [String!]) {
+      next_items_page (cursor: $cursor, limit: $limit) {
+        cursor
+        items { id name column_values (ids: $column_ids) { id type text value } }
+      }
+    }
+    """
+    variables = {"board_id": board_id or settings.MONDAY_BOARD_ID, "limit": page_size, "column_ids": column_ids}
+    data = _post(first, variables, "items_page")
+    boards = data["data"]["boards"]
+    if not boards:
+        return
+    page = boards[0]["items_page"]
+    while True:
+        yield from page["items"]
+        cursor = page.get("cursor")
+        if not cursor:
+            return
+        data = _post(following, {"cursor": cursor, "limit": page_size, "column_ids": column_ids}, "next_items_page")
+        page = data["data"]["next_items_page"]
+
+def create_webhook(url: str, event: str, board_id: int | None = None, config: dict | None = None) -> str:
+    mutation = """
+    mutation ($board_id: ID!, $url: String!, $event: WebhookEventType!, $config: JSON) {
+      create_webhook(board_id: $board_id, url: $url, event: $event, config: $config) {
+        id
+      }
+    }
+    """
+    data = _post(mutation, {
+        "board_id": board_id or settings.MONDAY_BOARD_ID,
+        "url": url,
+        "event": event,
+        "config": json.dumps(config) if config else None,
+    }, "create_webhook")
+    return str(data["data"]["create_webhook"]["id"])
+
+def get_board_columns_map(board_id: int | None = None):
     query = """
     query ($board_id: [ID!]) {
       boards (ids: $board_id) {
@@ -73,7 +125,7 @@ def get_board_columns_map():
       }
     }
     """
-    data = _post(query, {"board_id": settings.MONDAY_BOARD_ID})
+    data = _post(query, {"board_id": board_id or settings.MONDAY_BOARD_ID}, "board_columns")
     boards = data["data"]["boards"]
     if not boards:
         return [], {}, {}, {}, {}
@@ -96,10 +148,7 @@ def get_board_columns_map():
                 pass
     return cols, id_to_title, title_to_id, formulas, col_types
 
-def get_formula_expression(column_id: str) -> str | None:
-    _, _, _, formulas, _ = get_board_columns_map()
-    return formulas.get(column_id)
-
+@lru_cache(maxsize=512)
 def _translate_monday_expr(expr: str) -> str:
     if expr is None:
         return ""
@@ -193,41 +242,33 @@ def _safe_eval_arith_bool(expr: str) -> float:
     val = _eval(tree)
     return float(val) if isinstance(val, (int, float, bool)) else 0.0
 
-def compute_formula_value_for_item(formula_col_id: str, item_id: int) -> float | None:
-    _, id_to_title, title_to_id, formulas, col_types = get_board_columns_map()
-    query = """
-    query ($item_id: ID!) {
-      items (ids: [$item_id]) {
-        column_values {
-          id
-          type
-          text
-          value
-        }
-      }
-    }
+_TOKEN_RE = re.compile(r"\{([^}]+)\}")
+
+
+def formula_tokens(expr: str) -> list[str]:
+    return _TOKEN_RE.findall(expr or "")
+
+
+def _numeric_from_text(val_txt: str) -> float:
+    return float(re.sub(r"[^0-9\.\-]", "", (val_txt or "").replace(",", ".")) or 0)
+
+
+def make_formula_resolver(formulas: dict, col_types: dict, title_to_id: dict, lookup, cache_num: dict[str, float]):
+    """
+    Renvoie resolve_token(token) : valeur d'une colonne (id ou titre) pour l'item.
+    lookup(col_id) donne l'entrée de l'item : nombre, texte, ou None (formule / absente).
+    Les formules enfants sont évaluées récursivement et mémorisées dans cache_num.
     """
-    data = _post(query, {"item_id": item_id})
-    item_cols = data["data"]["items"][0]["column_values"]
-    id_to_numeric: dict[str, float] = {}
-    id_to_string: dict[str, str] = {}
-    for col in item_cols:
-        ctype = col_types.get(col["id"], col.get("type"))
-        val_txt = _extract_text_from_column(col)
-        if ctype == "numbers":
-            id_to_numeric[col["id"]] = float(re.sub(r"[^0-9\.\-]", "", val_txt.replace(",", ".")) or 0)
-        else:
-            id_to_string[col["id"]] = val_txt
     seen: set[str] = set()
-    cache_num: dict[str, float] = {}
     def resolve_token(token: str):
         col_id = token
         if col_id not in col_types and token in title_to_id:
             col_id = title_to_id[token]
-        if col_id in id_to_numeric:
-            return id_to_numeric[col_id]
-        if col_id in id_to_string:
-            return json.dumps(id_to_string[col_id], ensure_ascii=False)
+        val = lookup(col_id)
+        if isinstance(val, str):
+            return json.dumps(val, ensure_ascii=False)
+        if val is not None:
+            return val
         if col_types.get(col_id) == "formula":
             if col_id in cache_num:
                 return cache_num[col_id]
@@ -237,35 +278,24 @@ def compute_formula_value_for_item(formula_col_id: str, item_id: int) -> float |
             child_expr = formulas.get(col_id)
             if not child_expr:
                 seen.discard(col_id); return 0.0
-            child_expr = _translate_monday_expr(child_expr)
-            def repl_child(m: re.Match) -> str:
-                tk = m.group(1)
-                val = resolve_token(tk)
-                return str(val)
-            child_expr = re.sub(r"\{([^}]+)\}", repl_child, child_expr)
             try:
-                val = _safe_eval_arith_bool(child_expr)
+                val = eval_formula_expr(child_expr, resolve_token)
             except Exception:
                 val = 0.0
             cache_num[col_id] = val
             seen.discard(col_id)
             return val
         return 0.0
-    root = formulas.get(formula_col_id)
-    if not root:
-        return None
-    root_expr = _translate_monday_expr(root)
-    def repl_root(m: re.Match) -> str:
-        tk = m.group(1)
-        val = resolve_token(tk)
-        return str(val)
-    root_expr = re.sub(r"\{([^}]+)\}", repl_root, root_expr)
-    try:
-        return _safe_eval_arith_bool(root_expr)
-    except Exception:
-        return None
+    return resolve_token
 
-def set_link_in_column(item_id: int, column_id: str, url: str, text: str):
+
+def eval_formula_expr(expr: str, resolve_token) -> float:
+    translated = _translate_monday_expr(expr)
+    substituted = _TOKEN_RE.sub(lambda m: str(resolve_token(m.group(1))), translated)
+    return _safe_eval_arith_bool(substituted)
+
+
+def set_link_in_column(item_id: int, column_id: str, url: str, text: str, board_id: int | None = None):
     mutation = """
     mutation ($board_id: ID!, $item_id: ID!, $column_id: String!, $value: JSON!) {
       change_column_value(board_id: $board_id, item_id: $item_id, column_id: $column_id, value: $value) {
@@ -275,13 +305,13 @@ def set_link_in_column(item_id: int, column_id: str, url: str, text: str):
     """
     link_value = json.dumps({"url": url, "text": text}, ensure_ascii=False)
     _post(mutation, {
-        "board_id": settings.MONDAY_BOARD_ID,
+        "board_id": board_id or settings.MONDAY_BOARD_ID,
         "item_id": item_id,
         "column_id": column_id,
         "value": link_value
-    })
+    }, "change_column_value")
 
-def set_status(item_id: int, column_id: str, label: str):
+def set_status(item_id: int, column_id: str, label: str, board_id: int | None = None):
     mutation = """
     mutation ($board_id: ID!, $item_id: ID!, $column_id: String!, $value: String!) {
       change_simple_column_value(board_id: $board_id, item_id: $item_id, column_id: $column_id, value: $value) {
@@ -290,8 +320,102 @@ def set_status(item_id: int, column_id: str, label: str):
     }
     """
     _post(mutation, {
-        "board_id": settings.MONDAY_BOARD_ID,
+        "board_id": board_id or settings.MONDAY_BOARD_ID,
         "item_id": item_id,
         "column_id": column_id,
         "value": label
-    })
+    }, "change_simple_column_value")
+
+
+# ============================================================
+# Colonne fichier : lecture des fichiers + upload multipart en streaming
+# ============================================================
+
+
+def get_file_names(item_id: int, column_id: str) -> list[str]:
+    """Noms des fichiers déjà présents dans une colonne fichier de l'item."""
+    query = """
+    query ($item_id: ID!, $column_id: String!) {
+      items (ids: [$item_id]) {
+        column_values (ids: [$column_id]) {
+          value
+        }
+      }
+    }
+    """
+    data = _post(query, {"item_id": item_id, "column_id": column_id}, "file_names")
+    items = data["data"]["items"]
+    cols = items[0]["column_values"] if items else []
+    try:
+        value = json.loads(cols[0]["value"] or "{}") if cols else {}
+    except Exception:
+        return []
+    return [f.get("name") or "" for f in value.get("files") or []]
+
+
+class _MultipartBody:
+    """
+    Corps multipart/form-data lu par morceaux : requests l'envoie avec un
+    Content-Length exact, sans jamais assembler le fichier en mémoire.
+    """
+
+    def __init__(self, fields: dict, file_field: str, filename: str, fileobj, file_size: int,
+                 content_type: str = "application/pdf", chunk_size: int = 64 * 1024):
+        boundary = secrets.token_hex(16)
+        self.content_type = f"multipart/form-data; boundary={boundary}"
+        self.chunk_size = chunk_size
+        head = "".join(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{k}"\r\n\r\n{v}\r\n' for k, v in fields.items()
+        )
+        head += (
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{file_field}"; filename="{filename}"\r\n'
+            f"Content-Type: {content_type}\r\n\r\n"
+        )
+        tail = f"\r\n--{boundary}--\r\n".encode()
+        head_bytes = head.encode("utf-8")
+        self._parts = [io.BytesIO(head_bytes), fileobj, io.BytesIO(tail)]
+        self._length = len(head_bytes) + file_size + len(tail)
+
+    def __len__(self) -> int:
+        return self._length
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = self.chunk_size
+        out = b""
+        while self._parts and len(out) < size:
+            chunk = self._parts[0].read(size - len(out))
+            if not chunk:
+                self._parts.pop(0)
+                continue
+            out += chunk
+        return out
+
+    def __iter__(self):
+        while True:
+            chunk = self.read(self.chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+
+def add_file_to_column(item_id: int, column_id: str, filename: str, fileobj, file_size: int,
+                       timeout: float = 120) -> str:
+    """Upload (mutation add_file_to_column) d'un fichier lu par morceaux depuis fileobj."""
+    mutation = (
+        f"mutation ($file: File!) {{ add_file_to_column (item_id: {int(item_id)}, "
+        f"column_id: {json.dumps(column_id)}, file: $file) {{ id }} }}"
+    )
+    body = _MultipartBody(
+        {"query": mutation, "map": json.dumps({"pdf": "variables.file"})}, "pdf", filename, fileobj, file_size
+    )
+    resp = guarded_request(
+        "monday", "POST", MONDAY_FILE_API_URL,
+        headers={"Authorization": settings.MONDAY_API_KEY, "Content-Type": body.content_type},
+        data=body, timeout=timeout, adaptive=False,
+    )
+    resp.raise_for_status()
+    data = resp.json()
+    if "errors" in data and data["errors"]:
+        raise Exception(f"Erreur Monday: {data['errors']}")
+    return str(data["data"]["add_file_to_column"]["id"])
@@ -1,11 +1,10 @@
-import requests
-import json
-from .config import settings
+from .config import routing_tables, settings
+from .resilience import guarded_request
 
-def _choose_api_key(iban: str) -> str:
+def _choose_api_key(iban: str, key_dict: dict | None = None) -> str:
     """Sélectionne la clé PayPlug selon l’IBAN et le mode (test/live)."""
-    mode = (settings.PAYPLUG_MODE or "").lower()
-    key_dict = json.loads(settings.PAYPLUG_KEYS_TEST_JSON if mode == "test" else settings.PAYPLUG_KEYS_LIVE_JSON)
+    if key_dict is None:
+        key_dict = routing_tables()["payplug_keys"]
     return key_dict.get((iban or "").strip())
 
 def cents_from_str(amount_str: str) -> int:
@@ -40,7 +39,8 @@ def create_payment(api_key: str, amount_cents: int, email: str, address: str, cl
         "description": metadata.get("description", "Paiement acompte Energyz")
     }
     url = "https://api.payplug.com/v1/payments"
-    res = requests.post(url, headers=headers, json=payload)
+    # non idempotent : pas de timeout adaptatif (un paiement créé puis abandonné serait recréé)
+    res = guarded_request("payplug", "POST", url, headers=headers, json=payload, adaptive=False)
     if res.status_code not in [200, 201]:
         raise Exception(f"Erreur PayPlug : {res.status_code} → {res.text}")
     data = res.json()
@@ -0,0 +1,115 @@
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from .config import settings
+
+logger = logging.getLogger("energyz.prefetch")
+
+# ============================================================
+# Plans de paiement pré-résolus (montant, IBAN, clé PayPlug, client)
+# ============================================================
+
+
+class PlanCache:
+    """
+    Plans par (board, item, acompte), préparés avant que le label "Acompte N" ne tombe.
+    Chaque changement d'une colonne d'entrée incrémente la génération de l'item :
+    un plan calculé sur des valeurs périmées n'est jamais stocké. La génération
+    n'est gardée que tant qu'une résolution de l'item est en cours, et les plans
+    expirés sont purgés à chaque planification : la mémoire suit l'activité, pas
+    la taille du board.
+    """
+
+    def __init__(self, ttl_seconds: float, workers: int):
+        self.ttl_seconds = ttl_seconds
+        self._plans: dict[tuple[int, int, str], tuple[float, dict]] = {}
+        self._gen: dict[tuple[int, int], int] = {}
+        self._pending: dict[tuple[int, int, str], Future] = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prefetch")
+        self.counters = {"hits": 0, "misses": 0, "resolved": 0, "stale": 0, "failed": 0, "invalidated": 0,
+                         "expired": 0}
+
+    def take(self, board_id: int, item_id: int, acompte: str) -> dict | None:
+        """Plan prêt pour ce déclenchement (consommé : un lien = un paiement)."""
+        with self._lock:
+            entry = self._plans.pop((board_id, int(item_id), acompte), None)
+            if entry is None or time.monotonic() - entry[0] > self.ttl_seconds:
+                self.counters["misses"] += 1
+                return None
+            self.counters["hits"] += 1
+            return entry[1]
+
+    def _has_pending(self, key: tuple[int, int]) -> bool:
+        return any(k[:2] == key for k in self._pending)
+
+    def _prune(self) -> None:
+        """Retire les plans expirés (appelé sous verrou)."""
+        now = time.monotonic()
+        expired = [k for k, (at, _) in self._plans.items() if now - at > self.ttl_seconds]
+        for k in expired:
+            del self._plans[k]
+        self.counters["expired"] += len(expired)
+
+    def invalidate(self, board_id: int, item_id: int) -> list[str]:
+        """Oublie les plans de l'item ; renvoie les acomptes qui en avaient un."""
+        key = (board_id, int(item_id))
+        with self._lock:
+            if self._has_pending(key):
+                # une résolution en cours verra la génération changer
+                self._gen[key] = self._gen.get(key, 0) + 1
+            dropped = [k[2] for k in self._plans if k[:2] == key]
+            for acompte in dropped:
+                del self._plans[(*key, acompte)]
+            self.counters["invalidated"] += len(dropped)
+        return dropped
+
+    def schedule(self, board_id: int, item_id: int, acompte: str, resolve, *args) -> Future:
+        """Lance resolve(*args) en tâche de fond ; une résolution en cours pour la même clé est réutilisée."""
+        key = (board_id, int(item_id), acompte)
+        with self._lock:
+            fut = self._pending.get(key)
+            if fut is not None:
+                return fut
+            self._prune()
+            gen = self._gen.get(key[:2], 0)
+            fut = self._pool.submit(self._run, key, gen, resolve, args)
+            self._pending[key] = fut
+        return fut
+
+    def _run(self, key: tuple[int, int, str], gen: int, resolve, args: tuple) -> dict | None:
+        try:
+            plan = resolve(*args)
+        except Exception as e:
+            with self._lock:
+                self.counters["failed"] += 1
+                self._finish(key)
+            logger.info(f"[PLAN] board={key[0]} item_id={key[1]} acompte={key[2]} non résolu: {e}")
+            return None
+        with self._lock:
+            stale = self._gen.get(key[:2], 0) != gen
+            self._finish(key)
+            if stale:
+                # une colonne d'entrée a changé pendant la résolution
+                self.counters["stale"] += 1
+                return None
+            self._plans[key] = (time.monotonic(), plan)
+            self.counters["resolved"] += 1
+        logger.info(f"[PLAN] board={key[0]} item_id={key[1]} acompte={key[2]} prêt")
+        return plan
+
+    def _finish(self, key: tuple[int, int, str]) -> None:
+        """Fin d'une résolution (sous verrou) : plus rien en cours pour l'item, plus de génération à suivre."""
+        self._pending.pop(key, None)
+        if not self._has_pending(key[:2]):
+            self._gen.pop(key[:2], None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"enabled": settings.SPECULATIVE_PLANS, "cached": len(self._plans),
+                    "pending": len(self._pending), "tracked_items": len(self._gen), **self.counters}
+
+
+PLANS = PlanCache(settings.PLAN_TTL_SECONDS, settings.PREFETCH_CONCURRENCY)
@@ -0,0 +1,156 @@
+import contextvars
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from .config import settings
+
+# ============================================================
+# Profiler par échantillonnage (piles "collapsed" pour flamegraph)
+# ============================================================
+
+_THREAD_SUFFIX_RE = re.compile(r"_\d+$")
+
+
+class ProfileSession:
+    """
+    Échantillons de piles pendant une session. threads=None : tous les threads ;
+    sinon seulement les threads rattachés à la session (cf. run_tracked).
+    """
+
+    def __init__(self, threads: set[int] | None = None, max_requests: int | None = None):
+        self.threads = threads
+        self.max_requests = max_requests
+        self.requests = 0
+        self.samples = 0
+        self.stacks: Counter = Counter()
+        self.started = time.monotonic()
+        self.stopped: float | None = None
+        self.done = threading.Event()
+
+    def request_finished(self) -> None:
+        self.requests += 1
+        if self.max_requests is not None and self.requests >= self.max_requests:
+            self.done.set()
+
+    def collapsed(self) -> str:
+        """Format 'frame;frame;frame N' (flamegraph.pl, speedscope, ...)."""
+        return "".join(f"{stack} {n}\n" for stack, n in self.stacks.most_common())
+
+    def summary(self) -> dict:
+        end = self.stopped or time.monotonic()
+        return {"samples": self.samples, "requests": self.requests, "seconds": round(end - self.started, 3)}
+
+
+_SESSIONS: list[ProfileSession] = []
+_LOCK = threading.Lock()
+_SAMPLER: threading.Thread | None = None
+_REQUEST_SESSION: contextvars.ContextVar[ProfileSession | None] = contextvars.ContextVar(
+    "energyz_profile", default=None
+)
+
+# global : une seule session "admin" à la fois ; profils par requête : derniers N gardés
+ACTIVE: dict[str, ProfileSession | None] = {"global": None}
+PROFILES: "OrderedDict[str, ProfileSession]" = OrderedDict()
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _collapse(thread_name: str, frame) -> str:
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    labels.append(_THREAD_SUFFIX_RE.sub("", thread_name))
+    return ";".join(reversed(labels))
+
+
+def _sample_loop() -> None:
+    global _SAMPLER
+    me = threading.get_ident()
+    while True:
+        with _LOCK:
+            sessions = list(_SESSIONS)
+            if not sessions:
+                _SAMPLER = None
+                return
+        names = {t.ident: t.name for t in threading.enumerate()}
+        stacks: dict[int, str] = {}
+        for tid, frame in sys._current_frames().items():
+            if tid == me:
+                continue
+            for session in sessions:
+                if session.threads is not None and tid not in session.threads:
+                    continue
+                if tid not in stacks:
+                    stacks[tid] = _collapse(names.get(tid, f"thread-{tid}"), frame)
+                session.stacks[stacks[tid]] += 1
+        for session in sessions:
+            session.samples += 1
+        time.sleep(settings.PROFILE_INTERVAL_MS / 1000.0)
+
+
+def start(session: ProfileSession) -> ProfileSession:
+    """Le thread d'échantillonnage ne tourne que tant qu'une session est ouverte."""
+    global _SAMPLER
+    with _LOCK:
+        _SESSIONS.append(session)
+        if _SAMPLER is None:
+            _SAMPLER = threading.Thread(target=_sample_loop, name="profiler", daemon=True)
+            _SAMPLER.start()
+    return session
+
+
+def stop(session: ProfileSession) -> ProfileSession:
+    with _LOCK:
+        if session in _SESSIONS:
+            _SESSIONS.remove(session)
+    session.stopped = time.monotonic()
+    session.done.set()
+    return session
+
+
+def request_finished() -> None:
+    """Compteur des sessions globales limitées à N requêtes."""
+    session = ACTIVE["global"]
+    if session is not None:
+        session.request_finished()
+
+
+# ---------- Profil d'une seule requête ----------
+
+
+def start_request_profile() -> tuple[ProfileSession, contextvars.Token]:
+    session = start(ProfileSession(threads={threading.get_ident()}))
+    return session, _REQUEST_SESSION.set(session)
+
+
+def finish_request_profile(profile_id: str, session: ProfileSession, token: contextvars.Token) -> None:
+    _REQUEST_SESSION.reset(token)
+    stop(session)
+    with _LOCK:
+        PROFILES[profile_id] = session
+        while len(PROFILES) > settings.PROFILE_BUFFER_SIZE:
+            PROFILES.popitem(last=False)
+
+
+def run_tracked(fn, *args, **kwargs):
+    """
+    Exécute fn dans le thread courant en le rattachant au profil de la requête
+    (s'il y en a un) : utilisé là où le travail d'une requête change de thread.
+    """
+    session = _REQUEST_SESSION.get()
+    if session is None:
+        return fn(*args, **kwargs)
+    tid = threading.get_ident()
+    session.threads.add(tid)
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        session.threads.discard(tid)
@@ -0,0 +1,293 @@
+"""
+Enregistrement / rejeu du trafic webhook réel.
+
+Enregistrement (opt-in, RECORD_PATH) : chaque appel à /quote/from_monday ou
+/payplug/webhook est ajouté au fichier NDJSON avec les réponses upstream qu'il
+a provoquées, données personnelles masquées.
+
+Rejeu :
+    python -m app.replay enregistrement.ndjson --speed 10
+rejoue les requêtes contre l'app, upstreams remplacés par les réponses enregistrées,
+au rythme d'origine (ou accéléré) et affiche les latences observées.
+"""
+import argparse
+import asyncio
+import contextvars
+import hashlib
+import json
+import threading
+import time
+from collections import defaultdict, deque
+from functools import lru_cache
+
+import requests
+
+from .boards import board_configs
+from .config import settings
+from .resilience import RESPONSE_HOOKS, SESSIONS
+
+RECORDED_ROUTES = ("/quote/from_monday", "/payplug/webhook")
+
+_REDACT_KEYS = {
+    "email", "first_name", "last_name", "name", "item_name", "pulsename", "address", "address1",
+    "address2", "phone", "mobile", "postcode", "city", "street", "authorization", "api_key",
+    "access_token", "token", "secret_key", "public_key",
+}
+
+_CAPTURE: contextvars.ContextVar[list | None] = contextvars.ContextVar("energyz_replay_capture", default=None)
+# rejeu : réponses upstream enregistrées du record en cours, par upstream, dans l'ordre
+_REPLAYING: contextvars.ContextVar[dict | None] = contextvars.ContextVar("energyz_replay_record", default=None)
+_WRITE_LOCK = threading.Lock()
+
+
+# ============================================================
+# Enregistrement
+# ============================================================
+
+
+def _mask(value) -> str:
+    return "~" + hashlib.sha256(str(value).encode("utf-8")).hexdigest()[:10]
+
+
+@lru_cache(maxsize=1)
+def _personal_columns() -> frozenset[str]:
+    """Colonnes email / adresse / description de tous les boards servis (BOARDS_JSON compris)."""
+    columns = {settings.EMAIL_COLUMN_ID, settings.ADDRESS_COLUMN_ID, settings.DESCRIPTION_COLUMN_ID}
+    for board in board_configs().values():
+        columns |= {board.EMAIL_COLUMN_ID, board.ADDRESS_COLUMN_ID, board.DESCRIPTION_COLUMN_ID}
+    return frozenset(c for c in columns if c)
+
+
+def redact(obj):
+    """Masque (hash stable) les champs personnels / secrets, récursivement."""
+    if isinstance(obj, dict):
+        if (obj.get("id") or obj.get("columnId")) in _personal_columns():
+            # valeur de colonne Monday personnelle (email, adresse, description), item ou événement
+            return {k: (_mask(v) if k in ("text", "value", "previousValue") and v else v) for k, v in obj.items()}
+        return {
+            k: (_mask(v) if k.lower() in _REDACT_KEYS and isinstance(v, (str, int, float)) and v != "" else redact(v))
+            for k, v in obj.items()
+        }
+    if isinstance(obj, list):
+        return [redact(v) for v in obj]
+    return obj
+
+
+def _redacted_body(raw: bytes | str):
+    text = raw.decode("utf-8", errors="ignore") if isinstance(raw, bytes) else (raw or "")
+    try:
+        return redact(json.loads(text)) if text else None
+    except Exception:
+        return {"_text": _mask(text)}
+
+
+def _query_sig(query: str | None) -> str | None:
+    """Signature d'une requête GraphQL : distingue les opérations servies par la même URL."""
+    return hashlib.sha256(query.encode("utf-8")).hexdigest()[:10] if query else None
+
+
+def _request_query(body) -> str | None:
+    try:
+        data = json.loads(body) if body else None
+    except Exception:
+        return None
+    return data.get("query") if isinstance(data, dict) else None
+
+
+def _capture_upstream(upstream: str, method: str, url: str, r: requests.Response, elapsed: float) -> None:
+    capture = _CAPTURE.get()
+    if capture is None:
+        return
+    capture.append({
+        "u": upstream,
+        "m": method,
+        "url": url.split("?", 1)[0],
+        "q": _query_sig(_request_query(getattr(r.request, "body", None))),
+        "s": r.status_code,
+        "ms": round(elapsed * 1000, 1),
+        # corps binaires (PDF en streaming) non enregistrés : ni utiles au rejeu, ni à lire ici
+        "b": _redacted_body(r.content) if "json" in r.headers.get("Content-Type", "") else None,
+    })
+
+
+def start_capture() -> tuple[list, contextvars.Token]:
+    if _capture_upstream not in RESPONSE_HOOKS:
+        RESPONSE_HOOKS.append(_capture_upstream)
+    capture: list = []
+    return capture, _CAPTURE.set(capture)
+
+
+def finish_capture(token: contextvars.Token, capture: list, path: str, method: str, body: bytes,
+                   status: int, started: float, duration: float) -> None:
+    _CAPTURE.reset(token)
+    line = json.dumps({
+        "t": round(started, 3),
+        "path": path,
+        "m": method,
+        "body": _redacted_body(body),
+        "s": status,
+        "ms": round(duration * 1000, 1),
+        "up": capture,
+    }, ensure_ascii=False, separators=(",", ":"))
+    with _WRITE_LOCK:
+        with open(settings.RECORD_PATH, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+# ============================================================
+# Rejeu
+# ============================================================
+
+
+def _up_key(up: dict) -> tuple:
+    return (up["u"], up["m"].upper(), up["url"], up.get("q"))
+
+
+def _record_queues(record: dict) -> dict:
+    """Réponses upstream d'un record, par (upstream, méthode, URL, requête), dans l'ordre d'enregistrement."""
+    queues: dict[tuple, deque] = defaultdict(deque)
+    for up in record.get("up") or []:
+        queues[_up_key(up)].append(up)
+    return queues
+
+
+class _StandInSession:
+    """
+    Remplace la session d'un upstream : sert les réponses enregistrées du record
+    en cours de rejeu (contextvar), jamais celles d'une autre requête rejouée en
+    parallèle — toutes les requêtes Monday partagent la même URL GraphQL.
+    """
+
+    def __init__(self, upstream: str, records: list[dict]):
+        self.upstream = upstream
+        self.misses = 0
+        self.fallbacks = 0
+        # 1re réponse enregistrée par clé, tous records confondus : sert les appels qu'un
+        # cache de process (schéma, login...) a évités à l'enregistrement mais pas au rejeu
+        self.shared: dict[tuple, dict] = {}
+        for rec in records:
+            for up in rec.get("up") or []:
+                if up["u"] == upstream:
+                    self.shared.setdefault(_up_key(up), up)
+
+    def _lookup(self, method: str, url: str, query: str | None) -> dict | None:
+        base = (self.upstream, method.upper(), url.split("?", 1)[0])
+        keys = [(*base, _query_sig(query)), (*base, None)]  # None : enregistrements sans signature
+        queues = _REPLAYING.get() or {}
+        for key in keys:
+            if queues.get(key):
+                return queues[key].popleft()
+        for key in keys:
+            if key in self.shared:
+                self.fallbacks += 1
+                return self.shared[key]
+        return None
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        query = (kwargs.get("json") or {}).get("query") if isinstance(kwargs.get("json"), dict) else None
+        rec = self._lookup(method, url, query)
+        r = requests.Response()
+        r.url = url
+        r.headers["Content-Type"] = "application/json"
+        if rec is None:
+            self.misses += 1
+            r.status_code = 599
+            r._content = b'{"error":"replay: aucune reponse enregistree"}'
+            return r
+        # latence upstream d'origine
+        time.sleep(rec.get("ms", 0) / 1000.0)
+        r.status_code = rec["s"]
+        r._content = json.dumps(rec.get("b")).encode("utf-8")
+        return r
+
+    def head(self, url: str, **kwargs) -> requests.Response:
+        r = requests.Response()
+        r.status_code = 200
+        return r
+
+
+def load(path: str) -> list[dict]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+async def _call_asgi(app, method: str, path: str, body: bytes) -> int:
+    status = {"code": 0}
+    sent = {"done": False}
+
+    async def receive():
+        if sent["done"]:
+            return {"type": "http.disconnect"}
+        sent["done"] = True
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            status["code"] = message["status"]
+
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": method,
+        "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"", "root_path": "",
+        "headers": [(b"content-type", b"application/json")], "client": ("replay", 0), "server": ("replay", 80),
+    }
+    await app(scope, receive, send)
+    return status["code"]
+
+
+async def replay(records: list[dict], speed: float = 1.0) -> dict:
+    from .main import app
+
+    stand_ins = {name: _StandInSession(name, records) for name in SESSIONS}
+    originals = dict(SESSIONS)
+    SESSIONS.update(stand_ins)
+    record_path, settings.RECORD_PATH = settings.RECORD_PATH, None  # ne pas réenregistrer le rejeu
+    results: list[dict] = []
+    try:
+        t0 = records[0]["t"] if records else 0.0
+        start = time.monotonic()
+
+        async def one(rec: dict):
+            delay = (rec["t"] - t0) / speed if speed > 0 else 0.0
+            await asyncio.sleep(max(0.0, delay - (time.monotonic() - start)))
+            body = json.dumps(rec.get("body") or {}).encode("utf-8")
+            # tâche propre à ce record : le contexte (et donc ses réponses) suit la requête
+            # jusque dans les pools de threads (board, hedge, to_thread)
+            _REPLAYING.set(_record_queues(rec))
+            t = time.monotonic()
+            code = await _call_asgi(app, rec["m"], rec["path"], body)
+            results.append({"path": rec["path"], "status": code, "recorded_status": rec["s"],
+                            "ms": (time.monotonic() - t) * 1000, "recorded_ms": rec["ms"]})
+
+        await asyncio.gather(*(one(rec) for rec in records))
+    finally:
+        SESSIONS.update(originals)
+        settings.RECORD_PATH = record_path
+
+    def pct(values: list[float], p: float) -> float:
+        if not values:
+            return 0.0
+        values = sorted(values)
+        return round(values[min(len(values) - 1, int(p * len(values)))], 1)
+
+    replayed = [r["ms"] for r in results]
+    recorded = [r["recorded_ms"] for r in results]
+    return {
+        "requests": len(results),
+        "status_mismatches": sum(1 for r in results if r["status"] != r["recorded_status"]),
+        "upstream_misses": {name: s.misses for name, s in stand_ins.items() if s.misses},
+        "upstream_fallbacks": {name: s.fallbacks for name, s in stand_ins.items() if s.fallbacks},
+        "replayed_ms": {"p50": pct(replayed, 0.5), "p95": pct(replayed, 0.95), "p99": pct(replayed, 0.99)},
+        "recorded_ms": {"p50": pct(recorded, 0.5), "p95": pct(recorded, 0.95), "p99": pct(recorded, 0.99)},
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Rejoue un enregistrement de webhooks contre l'app.")
+    parser.add_argument("path")
+    parser.add_argument("--speed", type=float, default=1.0, help="facteur d'accélération (0 = sans attente)")
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(replay(load(args.path), args.speed)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,368 @@
+import contextvars
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Callable, TypeVar
+
+import requests
+from .config import settings
+from .profiler import run_tracked
+from .tracing import span
+
+T = TypeVar("T")
+
+# ============================================================
+# Circuit breakers par upstream (Monday / Evoliz / PayPlug)
+# ============================================================
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Levée quand un upstream est coupé : on échoue vite au lieu d'attendre."""
+
+    def __init__(self, upstream: str, retry_after: float):
+        self.upstream = upstream
+        self.retry_after = max(0.0, retry_after)
+        super().__init__(f"Circuit '{upstream}' ouvert (réessayer dans {self.retry_after:.0f}s)")
+
+
+class CircuitBreaker:
+    """
+    Fenêtre glissante des N derniers appels :
+    - ouvre si trop d'erreurs (taux >= failure_ratio) ou trop d'appels lents (>= slow_ratio)
+    - après open_seconds, passe en half-open et laisse passer quelques sondes
+    - une sonde OK referme le circuit, une sonde KO le rouvre
+    """
+
+    def __init__(
+        self,
+        name: str,
+        window: int = 20,
+        min_calls: int = 5,
+        failure_ratio: float = 0.5,
+        slow_call_seconds: float = 10.0,
+        slow_ratio: float = 0.8,
+        open_seconds: float = 30.0,
+        half_open_probes: int = 1,
+    ):
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_ratio = failure_ratio
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_ratio = slow_ratio
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+        self._calls: deque[tuple[bool, bool]] = deque(maxlen=window)  # (ok, slow)
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            self._maybe_half_open()
+            return self._state
+
+    def _maybe_half_open(self) -> None:
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+            self._state = HALF_OPEN
+            self._probes_in_flight = 0
+
+    def _trip(self) -> None:
+        self._state = OPEN
+        self._opened_at = time.monotonic()
+        self._probes_in_flight = 0
+        self._calls.clear()
+
+    def before_call(self) -> None:
+        with self._lock:
+            self._maybe_half_open()
+            if self._state == OPEN:
+                raise CircuitOpenError(self.name, self.open_seconds - (time.monotonic() - self._opened_at))
+            if self._state == HALF_OPEN:
+                if self._probes_in_flight >= self.half_open_probes:
+                    raise CircuitOpenError(self.name, self.open_seconds)
+                self._probes_in_flight += 1
+
+    def release(self) -> None:
+        """Appel abandonné sans verdict (deadline de l'appelant) : libère la sonde half-open."""
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._probes_in_flight = max(0, self._probes_in_flight - 1)
+
+    def record(self, ok: bool, elapsed: float) -> None:
+        slow = elapsed >= self.slow_call_seconds
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._probes_in_flight = max(0, self._probes_in_flight - 1)
+                if ok and not slow:
+                    self._state = CLOSED
+                    self._calls.clear()
+                else:
+                    self._trip()
+                return
+            if self._state == OPEN:
+                return
+            self._calls.append((ok, slow))
+            n = len(self._calls)
+            if n < self.min_calls:
+                return
+            failures = sum(1 for c_ok, _ in self._calls if not c_ok)
+            slows = sum(1 for _, c_slow in self._calls if c_slow)
+            if failures / n >= self.failure_ratio or slows / n >= self.slow_ratio:
+                self._trip()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            self._maybe_half_open()
+            n = len(self._calls)
+            return {
+                "state": self._state,
+                "calls": n,
+                "failures": sum(1 for ok, _ in self._calls if not ok),
+                "slow": sum(1 for _, slow in self._calls if slow),
+            }
+
+
+def _new_breaker(name: str) -> CircuitBreaker:
+    return CircuitBreaker(
+        name,
+        window=settings.BREAKER_WINDOW,
+        min_calls=settings.BREAKER_MIN_CALLS,
+        failure_ratio=settings.BREAKER_FAILURE_RATIO,
+        slow_call_seconds=settings.BREAKER_SLOW_CALL_SECONDS,
+        slow_ratio=settings.BREAKER_SLOW_RATIO,
+        open_seconds=settings.BREAKER_OPEN_SECONDS,
+    )
+
+
+BREAKERS: dict[str, CircuitBreaker] = {name: _new_breaker(name) for name in ("monday", "evoliz", "payplug")}
+
+
+# ============================================================
+# Deadline de la requête entrante + timeouts adaptatifs par endpoint
+# ============================================================
+
+
+class DeadlineExceeded(Exception):
+    """Budget de la requête entrante épuisé : inutile d'appeler un upstream de plus."""
+
+
+_DEADLINE: contextvars.ContextVar[float | None] = contextvars.ContextVar("energyz_deadline", default=None)
+
+
+@contextmanager
+def deadline(seconds: float | None):
+    """Borne tous les appels upstream du bloc (et des threads lancés avec son contexte)."""
+    if not seconds or seconds <= 0:
+        yield
+        return
+    current = _DEADLINE.get()
+    at = time.monotonic() + seconds
+    token = _DEADLINE.set(at if current is None else min(current, at))
+    try:
+        yield
+    finally:
+        _DEADLINE.reset(token)
+
+
+@contextmanager
+def deadline_exempt():
+    """Lève la deadline dans le bloc : écritures à faire quoi qu'il arrive (ex. après un paiement créé)."""
+    token = _DEADLINE.set(None)
+    try:
+        yield
+    finally:
+        _DEADLINE.reset(token)
+
+
+def remaining() -> float | None:
+    """Secondes restantes avant la deadline courante (None : pas de deadline)."""
+    at = _DEADLINE.get()
+    return None if at is None else at - time.monotonic()
+
+
+def check_deadline(what: str = "") -> None:
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded(f"Deadline dépassée{f' ({what})' if what else ''}")
+
+
+class LatencyTracker:
+    """Latences récentes (succès uniquement) d'un endpoint upstream."""
+
+    def __init__(self, window: int):
+        self._samples: deque[float] = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def add(self, elapsed: float) -> None:
+        with self._lock:
+            self._samples.append(elapsed)
+
+    def percentile(self, p: float) -> float | None:
+        with self._lock:
+            if len(self._samples) < settings.ADAPTIVE_TIMEOUT_MIN_SAMPLES:
+                return None
+            values = sorted(self._samples)
+        return values[min(len(values) - 1, int(p * len(values)))]
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            values = sorted(self._samples)
+        if not values:
+            return {"samples": 0}
+        pick = lambda p: round(values[min(len(values) - 1, int(p * len(values)))] * 1000)
+        return {"samples": len(values), "p50_ms": pick(0.5), "p99_ms": pick(0.99)}
+
+
+LATENCIES: dict[str, LatencyTracker] = {}
+_LATENCIES_LOCK = threading.Lock()
+_ID_SEGMENT_RE = re.compile(r"/\d+(?=/|$)")
+
+
+def _endpoint_key(upstream: str, method: str, url: str) -> str:
+    """'evoliz GET /api/v1/companies/:id/quotes/:id/pdf' : les ids ne créent pas d'endpoints."""
+    path = url.split("?", 1)[0].split("://", 1)[-1]
+    return f"{upstream} {method.upper()} {_ID_SEGMENT_RE.sub('/:id', path)}"
+
+
+def _tracker(key: str) -> LatencyTracker:
+    tracker = LATENCIES.get(key)
+    if tracker is None:
+        with _LATENCIES_LOCK:
+            tracker = LATENCIES.setdefault(key, LatencyTracker(settings.LATENCY_WINDOW))
+    return tracker
+
+
+def adaptive_timeout(key: str, ceiling: float) -> float:
+    """
+    Timeout d'un endpoint : percentile observé x marge, borné par [min, ceiling].
+    Tant que l'historique est trop court, on garde le plafond.
+    """
+    p = _tracker(key).percentile(settings.ADAPTIVE_TIMEOUT_PERCENTILE)
+    if p is None:
+        return ceiling
+    return min(ceiling, max(settings.ADAPTIVE_TIMEOUT_MIN_SECONDS, p * settings.ADAPTIVE_TIMEOUT_FACTOR))
+
+
+def latency_snapshot() -> dict:
+    return {key: t.snapshot() for key, t in sorted(LATENCIES.items())}
+
+
+# ============================================================
+# Sessions HTTP + appel gardé
+# ============================================================
+
+
+def _new_session() -> requests.Session:
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=16)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+# Une session (pool de connexions keep-alive) par upstream
+SESSIONS: dict[str, requests.Session] = {name: _new_session() for name in BREAKERS}
+
+# Observateurs des réponses upstream : (upstream, method, url, response, elapsed_s)
+RESPONSE_HOOKS: list[Callable[[str, str, str, requests.Response, float], None]] = []
+
+
+def guarded_request(
+    upstream: str, method: str, url: str, *, operation: str | None = None, adaptive: bool = True, **kwargs
+) -> requests.Response:
+    """
+    Requête via la session (pool keep-alive) de l'upstream, derrière son breaker.
+    Seuls les timeouts / erreurs réseau / 5xx comptent comme échecs :
+    les 4xx (ex. 404 des endpoints PDF sondés) sont des réponses normales.
+
+    Timeout effectif : min(timeout demandé, timeout adaptatif de l'endpoint,
+    temps restant avant la deadline de la requête entrante).
+    - operation : clé des latences quand l'URL ne suffit pas (GraphQL : une URL, N opérations)
+    - adaptive=False (POST non idempotent) : ni plafond adaptatif ni coupure par la deadline
+      une fois l'appel parti ; l'abandonner risquerait un doublon au réessai
+    """
+    check_deadline(f"{upstream} {method}")
+    key = _endpoint_key(upstream, method, url)
+    if operation:
+        key = f"{key} {operation}"
+    timeout = kwargs.pop("timeout", None) or settings.UPSTREAM_TIMEOUT_SECONDS
+    if adaptive:
+        timeout = adaptive_timeout(key, timeout)
+    left = remaining()
+    cut_by_deadline = adaptive and left is not None and left < timeout
+    kwargs["timeout"] = left if cut_by_deadline else timeout
+    breaker = BREAKERS[upstream]
+    breaker.before_call()
+    with span(f"{upstream} {method}", url=url, timeout_s=round(kwargs["timeout"], 3)) as sp:
+        start = time.monotonic()
+        try:
+            r = SESSIONS[upstream].request(method, url, **kwargs)
+        except requests.Timeout:
+            if cut_by_deadline:
+                # c'est notre budget qui est épuisé, pas forcément l'upstream qui est lent
+                breaker.release()
+                raise DeadlineExceeded(f"Deadline dépassée ({upstream} {method})")
+            breaker.record(False, time.monotonic() - start)
+            raise
+        except requests.RequestException:
+            breaker.record(False, time.monotonic() - start)
+            raise
+        elapsed = time.monotonic() - start
+        breaker.record(r.status_code < 500, elapsed)
+        # seuls les succès comptent : les 404 rapides (sondes PDF) fausseraient le p99
+        if 200 <= r.status_code < 300:
+            _tracker(key).add(elapsed)
+        if sp is not None:
+            sp["attributes"]["http.status_code"] = r.status_code
+        for hook in RESPONSE_HOOKS:
+            hook(upstream, method, url, r, elapsed)
+        return r
+
+
+def warm_connection(upstream: str, url: str) -> int:
+    """Ouvre (TLS compris) une connexion du pool de l'upstream, hors breaker."""
+    r = SESSIONS[upstream].head(url, timeout=settings.UPSTREAM_TIMEOUT_SECONDS)
+    return r.status_code
+
+
+def breakers_snapshot() -> dict:
+    return {name: b.snapshot() for name, b in BREAKERS.items()}
+
+
+# ============================================================
+# Requêtes "hedgées" (lectures idempotentes uniquement)
+# ============================================================
+
+_HEDGE_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix="hedge")
+
+
+def hedged(fn: Callable[[], T], after_ms: int | None = None) -> T:
+    """
+    Lance fn(); si pas de réponse après `after_ms`, lance une 2e copie et garde
+    la première qui réussit. Sans délai configuré, simple appel direct.
+    """
+    delay = settings.HEDGE_AFTER_MS if after_ms is None else after_ms
+    if not delay or delay <= 0:
+        return fn()
+    # chaque copie garde le contexte (trace courante) de l'appelant
+    first = _HEDGE_POOL.submit(contextvars.copy_context().run, run_tracked, fn)
+    done, _ = wait([first], timeout=delay / 1000.0)
+    if done:
+        return first.result()
+    pending = {first, _HEDGE_POOL.submit(contextvars.copy_context().run, run_tracked, fn)}
+    last_exc: BaseException | None = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for fut in done:
+            exc = fut.exception()
+            if exc is None:
+                return fut.result()
+            last_exc = exc
+    raise last_exc
@@ -0,0 +1,122 @@
+import json
+
+from .monday import _extract_text_from_column, _numeric_from_text
+
+# ============================================================
+# Snapshot compact d'un item Monday
+# ============================================================
+
+
+class ItemSnapshot:
+    """
+    Valeurs d'un item rangées dans des listes indexées par la position des colonnes
+    du schéma (schema.column_index) : pas de dict par item ni de doublon "__raw".
+    Le JSON brut n'est décodé qu'à la lecture, et les formules calculées pour
+    l'item sont mémorisées à côté (cf. formulas.py).
+
+    Seule représentation d'un item dans l'application ; lecture par
+    snap.get("name"), snap.get(col_id), snap.get(col_id + "__raw").
+    """
+
+    __slots__ = ("schema", "item_id", "name", "_texts", "_raws", "_parsed", "formulas")
+
+    def __init__(self, schema, item_id: int, name: str = ""):
+        n = len(schema.column_ids)
+        self.schema = schema
+        self.item_id = int(item_id)
+        self.name = name
+        self._texts: list[str | None] = [None] * n
+        self._raws: list[str | None] = [None] * n
+        self._parsed: list | None = None
+        self.formulas: dict[str, float] = {}
+
+    @classmethod
+    def from_item(cls, schema, item: dict, item_id: int | None = None) -> "ItemSnapshot":
+        """Depuis un item de l'API (name + column_values[id, text, value])."""
+        snap = cls(schema, item_id if item_id is not None else item["id"], item.get("name") or "")
+        index = schema.column_index
+        for col in item.get("column_values") or []:
+            i = index.get(col["id"])
+            if i is not None:
+                snap._texts[i] = col.get("text") or ""
+                snap._raws[i] = col.get("value") or ""
+        return snap
+
+    def set(self, column_id: str, text: str, raw: str = "") -> None:
+        i = self.schema.column_index.get(column_id)
+        if i is None:
+            return
+        self._texts[i] = text or ""
+        self._raws[i] = raw or ""
+        if self._parsed is not None:
+            self._parsed[i] = None
+
+    def discard(self, column_id: str) -> None:
+        i = self.schema.column_index.get(column_id)
+        if i is not None:
+            self._texts[i] = self._raws[i] = None
+
+    def has(self, column_id: str) -> bool:
+        i = self.schema.column_index.get(column_id)
+        return i is not None and self._texts[i] is not None
+
+    def text(self, column_id: str, default: str = "") -> str:
+        i = self.schema.column_index.get(column_id)
+        if i is None or self._texts[i] is None:
+            return default
+        if self._texts[i]:
+            return self._texts[i]
+        # texte vide : on retombe sur la valeur JSON, décodée seulement maintenant
+        parsed = self.value(column_id)
+        return _extract_text_from_column({"text": "", "value": parsed if parsed is not None else self._raws[i]})
+
+    def raw(self, column_id: str, default: str = "") -> str:
+        i = self.schema.column_index.get(column_id)
+        if i is None or self._raws[i] is None:
+            return default
+        return self._raws[i]
+
+    def value(self, column_id: str):
+        """Valeur JSON décodée (paresseusement, puis mémorisée)."""
+        i = self.schema.column_index.get(column_id)
+        if i is None or not self._raws[i]:
+            return None
+        if self._parsed is None:
+            self._parsed = [None] * len(self._raws)
+        if self._parsed[i] is None:
+            try:
+                self._parsed[i] = json.loads(self._raws[i])
+            except Exception:
+                return None
+        return self._parsed[i]
+
+    def formula_input(self, column_id: str) -> float | str | None:
+        """Entrée pour le moteur de formules : nombre, texte, ou None (formule / absente)."""
+        ctype = self.schema.col_types.get(column_id)
+        if ctype == "formula" or not self.has(column_id):
+            return None
+        if ctype == "numbers":
+            try:
+                return _numeric_from_text(self.text(column_id))
+            except ValueError:
+                return 0.0
+        return self.text(column_id)
+
+    def get(self, key: str, default=None):
+        if key == "name":
+            return self.name
+        if key.endswith("__raw"):
+            col = key[:-5]
+            return self.raw(col) if self.has(col) else default
+        return self.text(key) if self.has(key) else default
+
+    def to_dict(self, column_ids: list[str] | None = None) -> dict:
+        ids = column_ids if column_ids is not None else self.schema.column_ids
+        out = {"name": self.name}
+        for cid in ids:
+            if self.has(cid):
+                out[cid] = self.text(cid)
+        return out
+
+    def __repr__(self) -> str:
+        return f"ItemSnapshot(item_id={self.item_id}, {self.to_dict()})"
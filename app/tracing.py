@@ -0,0 +1,164 @@
+import contextvars
+import logging
+import re
+import secrets
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from .config import settings
+
+# ============================================================
+# Traces par requête : spans (étapes + appels upstream) en mémoire
+# ============================================================
+
+
+class Trace:
+    __slots__ = ("trace_id", "name", "start_ns", "end_ns", "spans", "attributes")
+
+    def __init__(self, name: str, trace_id: str | None = None):
+        self.trace_id = trace_id or secrets.token_hex(16)
+        self.name = name
+        self.start_ns = time.time_ns()
+        self.end_ns: int | None = None
+        self.spans: list[dict] = []
+        self.attributes: dict = {}
+
+    @property
+    def duration_ms(self) -> float | None:
+        if self.end_ns is None:
+            return None
+        return round((self.end_ns - self.start_ns) / 1e6, 2)
+
+    def summary(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "start_ns": self.start_ns,
+            "duration_ms": self.duration_ms,
+            "spans": len(self.spans),
+            "attributes": self.attributes,
+        }
+
+    def to_dict(self) -> dict:
+        spans = [
+            {**s, "duration_ms": round((s["end_ns"] - s["start_ns"]) / 1e6, 2) if s["end_ns"] else None}
+            for s in self.spans
+        ]
+        return {**self.summary(), "spans": spans}
+
+
+_TRACE: contextvars.ContextVar[Trace | None] = contextvars.ContextVar("energyz_trace", default=None)
+_SPAN: contextvars.ContextVar[str | None] = contextvars.ContextVar("energyz_span", default=None)
+
+TRACES: deque[Trace] = deque(maxlen=settings.TRACE_BUFFER_SIZE)
+_TRACES_LOCK = threading.Lock()
+
+_TRACE_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+
+
+def current_trace_id() -> str | None:
+    trace = _TRACE.get()
+    return trace.trace_id if trace else None
+
+
+@contextmanager
+def start_trace(name: str, trace_id: str | None = None):
+    """Ouvre une trace pour la requête ; elle rejoint le ring buffer à la fin."""
+    if trace_id and not _TRACE_ID_RE.match(trace_id):
+        trace_id = None
+    trace = Trace(name, trace_id)
+    token = _TRACE.set(trace)
+    try:
+        with span(name):
+            yield trace
+    finally:
+        trace.end_ns = time.time_ns()
+        _TRACE.reset(token)
+        with _TRACES_LOCK:
+            TRACES.append(trace)
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Span enfant du span courant ; sans trace active, ne fait rien."""
+    trace = _TRACE.get()
+    if trace is None:
+        yield None
+        return
+    record = {
+        "span_id": secrets.token_hex(8),
+        "parent_id": _SPAN.get(),
+        "name": name,
+        "start_ns": time.time_ns(),
+        "end_ns": None,
+        "attributes": attributes,
+        "error": None,
+    }
+    trace.spans.append(record)
+    token = _SPAN.set(record["span_id"])
+    try:
+        yield record
+    except BaseException as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        record["end_ns"] = time.time_ns()
+        _SPAN.reset(token)
+
+
+def recent_traces(limit: int = 50) -> list[Trace]:
+    with _TRACES_LOCK:
+        items = list(TRACES)
+    return items[::-1][:limit]
+
+
+def find_trace(trace_id: str) -> Trace | None:
+    with _TRACES_LOCK:
+        for trace in TRACES:
+            if trace.trace_id == trace_id:
+                return trace
+    return None
+
+
+def _otlp_value(v) -> dict:
+    if isinstance(v, bool):
+        return {"boolValue": v}
+    if isinstance(v, int):
+        return {"intValue": str(v)}
+    if isinstance(v, float):
+        return {"doubleValue": v}
+    return {"stringValue": str(v)}
+
+
+def to_otlp(traces: list[Trace]) -> dict:
+    """Export au format OTLP/JSON (ExportTraceServiceRequest)."""
+    spans = []
+    for trace in traces:
+        for s in trace.spans:
+            spans.append({
+                "traceId": trace.trace_id,
+                "spanId": s["span_id"],
+                "parentSpanId": s["parent_id"] or "",
+                "name": s["name"],
+                "kind": 1,
+                "startTimeUnixNano": str(s["start_ns"]),
+                "endTimeUnixNano": str(s["end_ns"] or s["start_ns"]),
+                "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in s["attributes"].items()],
+                "status": {"code": 2, "message": s["error"]} if s["error"] else {"code": 1},
+            })
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": "energyz-payplug-api"}}]},
+            "scopeSpans": [{"scope": {"name": "energyz.tracing"}, "spans": spans}],
+        }]
+    }
+
+
+class TraceIdLogFilter(logging.Filter):
+    """Ajoute %(trace_id)s aux enregistrements de log."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.trace_id = current_trace_id() or "-"
+        return True
@@ -0,0 +1,85 @@
+import asyncio
+import logging
+import time
+
+from .boards import board_configs
+from .config import settings
+from .evoliz import _login, sync_directory
+from .formulas import get_schema
+from .monday import MONDAY_API_URL, _translate_monday_expr
+from .resilience import warm_connection
+
+logger = logging.getLogger("energyz.warmup")
+
+# ============================================================
+# Warm-up au démarrage (lifespan FastAPI)
+# ============================================================
+
+READINESS: dict = {"ready": False, "degraded": False, "started_at": None, "finished_at": None, "steps": {}}
+
+# étapes sans lesquelles un webhook ne peut pas aboutir (l'annuaire Evoliz n'est qu'un cache)
+REQUIRED_STEPS = ("monday_connection", "payplug_connection", "evoliz_login", "board_schema", "routing_tables")
+
+
+def _compile_formulas() -> int:
+    """Schéma de chaque board servi + traduction (mise en cache) de toutes ses formules."""
+    count = 0
+    for board_id in board_configs():
+        schema = get_schema(board_id, force=True)
+        for expr in schema.formulas.values():
+            _translate_monday_expr(expr)
+        count += len(schema.formulas)
+    return count
+
+
+def _steps() -> dict:
+    return {
+        "monday_connection": lambda: warm_connection("monday", MONDAY_API_URL),
+        "payplug_connection": lambda: warm_connection("payplug", "https://api.payplug.com"),
+        "evoliz_login": _login,
+        "evoliz_directory": lambda: sync_directory(full=True),
+        "board_schema": _compile_formulas,
+        "routing_tables": lambda: len(board_configs()),
+    }
+
+
+async def _run_step(name: str, fn) -> None:
+    start = time.monotonic()
+    try:
+        await asyncio.to_thread(fn)
+        READINESS["steps"][name] = {"ok": True, "ms": round((time.monotonic() - start) * 1000)}
+    except Exception as e:
+        READINESS["steps"][name] = {"ok": False, "ms": round((time.monotonic() - start) * 1000), "error": str(e)}
+        logger.warning(f"[WARMUP] {name} KO: {e}")
+    if READINESS["finished_at"] is not None:
+        # étape terminée après le budget : le mode dégradé peut être levé
+        READINESS["degraded"] = not _required_ok()
+
+
+def _required_ok() -> bool:
+    return all(READINESS["steps"].get(name, {}).get("ok") for name in REQUIRED_STEPS)
+
+
+async def run_warmup(budget_seconds: float | None = None) -> dict:
+    """
+    Lance les étapes en parallèle (tâche de fond du lifespan : / répond pendant ce temps).
+    Prêt dès que les étapes requises ont réussi ; sinon à l'expiration du budget, en
+    mode dégradé, les étapes restantes étant signalées 'pending' jusqu'à leur fin.
+    """
+    budget = settings.WARMUP_BUDGET_SECONDS if budget_seconds is None else budget_seconds
+    READINESS.update({"ready": False, "degraded": False, "started_at": time.time(), "finished_at": None, "steps": {}})
+    loop = asyncio.get_running_loop()
+    expires_at = loop.time() + budget
+    steps = _steps()
+    tasks = {name: asyncio.create_task(_run_step(name, fn)) for name, fn in steps.items()}
+    await asyncio.wait([tasks[name] for name in REQUIRED_STEPS], timeout=budget)
+    if not _required_ok():
+        # étape requise en échec : pas prête avant la fin du budget
+        await asyncio.sleep(max(0.0, expires_at - loop.time()))
+    for name in steps:
+        READINESS["steps"].setdefault(name, {"ok": False, "pending": True})
+    READINESS["finished_at"] = time.time()
+    READINESS["degraded"] = not _required_ok()
+    READINESS["ready"] = True
+    logger.info(f"[WARMUP] degraded={READINESS['degraded']} steps={READINESS['steps']}")
+    return READINESS